@@ -0,0 +1,177 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cache
+import heredity
+
+# Columns written for each person
+FIELDS = ["file", "family", "person", "gene_0", "gene_1", "gene_2", "trait"]
+
+
+def main():
+
+    # Check for proper usage
+    parser = argparse.ArgumentParser(
+        description="Infer gene and trait probabilities for many families."
+    )
+    parser.add_argument(
+        "paths", nargs="+",
+        help="CSV files, directories of CSV files or glob patterns"
+    )
+    parser.add_argument(
+        "--format", choices=["ndjson", "csv"], default="ndjson",
+        help="output format, one record per person"
+    )
+    parser.add_argument(
+        "--output", help="file to write results to (default: stdout)"
+    )
+    parser.add_argument(
+        "--engine", choices=sorted(heredity.ENGINES), default="peel",
+        help="inference engine used for every file"
+    )
+    parser.add_argument(
+        "--mutation", type=float, default=heredity.PROBS["mutation"],
+        help="probability that a passed gene mutates"
+    )
+    parser.add_argument(
+        "--workers", type=int,
+        help="files processed at once (default: CPUs)"
+    )
+    parser.add_argument(
+        "--report",
+        help="file to write one JSON record per input file to, with its "
+             "path, people, seconds and error (null if it succeeded)"
+    )
+    parser.add_argument(
+        "--cache", help="SQLite file caching results across runs"
+    )
+    parser.add_argument(
+        "--cache-bytes", type=int, default=cache.MAX_BYTES,
+        help="size limit of the cache before old results are evicted"
+    )
+    args = parser.parse_args()
+    model = heredity.Model(dict(heredity.PROBS, mutation=args.mutation))
+    files = expand_paths(args.paths)
+
+    # Results are written in input order as each file finishes
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    report = open(args.report, "w") if args.report else None
+    failures = 0
+    try:
+        write = writer(out, args.format)
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            results = pool.map(
+                infer_file, files,
+                [args.engine] * len(files), [model] * len(files),
+                [args.cache] * len(files), [args.cache_bytes] * len(files)
+            )
+            for path, rows, seconds, error in results:
+                if error is None:
+                    for row in rows:
+                        write(row)
+                    print(f"{path}: {len(rows)} people in {seconds:.3f}s",
+                          file=sys.stderr)
+                else:
+                    failures += 1
+                    print(f"{path}: failed: {error}", file=sys.stderr)
+                if report is not None:
+                    report.write(json.dumps({
+                        "path": path,
+                        "people": None if rows is None else len(rows),
+                        "seconds": seconds,
+                        "error": error
+                    }) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if report is not None:
+            report.close()
+
+    print(f"{len(files) - failures} of {len(files)} files succeeded",
+          file=sys.stderr)
+    if args.cache:
+        with cache.ResultCache(args.cache, args.cache_bytes) as results:
+            print(f"cache: {json.dumps(results.stats())}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+def expand_paths(paths):
+    """
+    Return the CSV files named by `paths`, expanding directories and glob
+    patterns. Paths that match nothing are kept so they are reported as
+    failures rather than silently dropped.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.csv"))))
+        elif glob.has_magic(path):
+            files.extend(sorted(glob.glob(path)))
+        else:
+            files.append(path)
+    return files
+
+
+def infer_file(path, engine, model, cache_path=None, cache_bytes=None):
+    """
+    Run inference on every family in the CSV at `path`, reusing results
+    from the cache at `cache_path` if given.
+    Return (path, rows, seconds, error) where `rows` holds one dictionary
+    per person with the `FIELDS` keys, and `error` describes what went
+    wrong if the file could not be processed.
+    """
+    start = time.perf_counter()
+    results = None
+    try:
+        if cache_path is not None:
+            results = cache.ResultCache(cache_path, cache_bytes)
+        rows = []
+        for family, people in enumerate(heredity.iter_families(path)):
+            if results is None:
+                probabilities = heredity.run_engine(engine, people, model)
+            else:
+                probabilities = cache.cached_run_engine(
+                    results, engine, people, model
+                )
+            for person in people.names:
+                gene = probabilities[person]["gene"]
+                rows.append({
+                    "file": path,
+                    "family": family,
+                    "person": person,
+                    "gene_0": gene[0],
+                    "gene_1": gene[1],
+                    "gene_2": gene[2],
+                    "trait": probabilities[person]["trait"][True]
+                })
+    except Exception as e:
+        return path, None, time.perf_counter() - start, f"{e!r}"
+    finally:
+        if results is not None:
+            results.close()
+    return path, rows, time.perf_counter() - start, None
+
+
+def writer(out, output_format):
+    """
+    Return a function that writes one result row to `out` in `output_format`.
+    """
+    if output_format == "csv":
+        csv_writer = csv.DictWriter(out, fieldnames=FIELDS)
+        csv_writer.writeheader()
+        return csv_writer.writerow
+
+    def write_json(row):
+        out.write(json.dumps(row) + "\n")
+    return write_json
+
+
+if __name__ == "__main__":
+    main()
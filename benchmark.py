@@ -0,0 +1,287 @@
+import argparse
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import heredity
+
+# Engines whose work grows as 3 to the power of family size
+EXPONENTIAL = {"batch", "enumerate", "enumerate-log", "parallel", "search"}
+
+# Families measured by default, from tiny to population-sized
+SCENARIOS = {
+    "nuclear": dict(size=7, depth=2, sibship=4),
+    "three-generations": dict(size=10, depth=3, sibship=2, founder_ratio=1),
+    "inbred": dict(size=10, depth=4, sibship=2, founder_ratio=1, loops=1),
+    "extended": dict(size=60, depth=4, sibship=3),
+    "extended-inbred": dict(size=60, depth=5, sibship=3, loops=2),
+    "population": dict(size=500, depth=6, sibship=3, founder_ratio=0.8)
+}
+
+# Options that keep sampling engines' runs short and repeatable
+OPTIONS = {"sweeps": 200}
+
+# Growth below which a measurement is treated as noise, however large
+# relative to the earlier one
+FLOORS = {"seconds": 0.01, "peak_bytes": 64 * 1024}
+
+
+def main():
+
+    # Check for proper usage
+    parser = argparse.ArgumentParser(
+        description="Time inference engines on synthetic families."
+    )
+    parser.add_argument(
+        "--engines", nargs="+", choices=sorted(heredity.ENGINES),
+        default=sorted(heredity.ENGINES), help="engines to measure"
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS),
+        default=list(SCENARIOS), help="families to measure them on"
+    )
+    parser.add_argument(
+        "--max-enumerate", type=int, default=11,
+        help="largest family given to exponential engines"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3,
+        help="runs per measurement; the fastest is kept"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the JSON report to")
+    parser.add_argument(
+        "--compare", help="earlier JSON report to check for regressions"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25,
+        help="relative slowdown or memory growth counted as a regression"
+    )
+    args = parser.parse_args()
+
+    report = {
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "results": []
+    }
+    for scenario in args.scenarios:
+        pedigree = generate(seed=args.seed, **SCENARIOS[scenario])
+        for engine in args.engines:
+            if engine in EXPONENTIAL and len(pedigree) > args.max_enumerate:
+                continue
+            result = measure(engine, pedigree, args.repeat, args.seed)
+            result.update(scenario=scenario, people=len(pedigree),
+                          loops=count_loops(pedigree))
+            report["results"].append(result)
+            print(f"{scenario:>18} {engine:>14} {len(pedigree):>5} people "
+                  f"{result['seconds']:10.4f}s {result['peak_bytes']:>12} B",
+                  file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for line in regressions:
+            print(f"regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+def generate(size=50, depth=4, sibship=3, founder_ratio=0.6, evidence=0.5,
+             loops=0, probs=heredity.PROBS, seed=None):
+    """
+    Return a random `Pedigree` of exactly `size` people descended from one
+    founding couple over `depth` generations, with `loops` couples of
+    cousins who have children, closing inbreeding loops. Raise ValueError
+    if the pedigree cannot be built to that specification.
+
+    Each couple has at least one child and on average about `sibship`. A child
+    goes on to have children of their own with an outside founder with
+    probability `founder_ratio`, or always while cousin couples are still
+    to be formed, so that later generations have cousins. Cousins marry
+    as soon as there are any. Once the last generation is reached, its
+    parents have more children in turn until the family has `size`
+    people. Genes and traits are drawn from `probs`, and each trait is
+    observed with probability `evidence`.
+    """
+    rng = random.Random(seed)
+    model = heredity.Model(probs)
+    names = []
+    mothers = []
+    fathers = []
+    genes = []
+
+    def add(mother=-1, father=-1):
+        if mother < 0:
+            weights = model.prior
+        else:
+            weights = [model.inherit[g][genes[mother]][genes[father]]
+                       for g in heredity.GENES]
+        names.append(f"p{len(names)}")
+        mothers.append(mother)
+        fathers.append(father)
+        genes.append(rng.choices(heredity.GENES, weights)[0])
+        return len(names) - 1
+
+    couples = [(add(), add())]
+    cousin_couples = 0
+    for generation in range(2, depth + 1):
+
+        # Every couple has a child before any has more, and room is kept
+        # for the children of the cousin couples still to be formed. A
+        # lone couple has two while loops are wanted, so there will be
+        # cousins in the generation after.
+        last = generation == depth
+        reserve = 0 if last else loops - cousin_couples
+        least = 2 if reserve and len(couples) == 1 else 1
+        children = [(add(mother, father), (mother, father))
+                    for mother, father in couples for _ in range(least)]
+        for mother, father in couples:
+            most = max(least, 2 * sibship - 1)
+            for _ in range(rng.randint(least, most) - least):
+                if len(names) + reserve < size:
+                    children.append((add(mother, father), (mother, father)))
+        if last:
+            break
+
+        # Couples for the next generation, each with room for a child:
+        # cousins first, then children with outside spouses
+        cousins = [(a, b) for (a, pa), (b, pb)
+                   in itertools.combinations(children, 2) if pa != pb]
+        wanted = min(loops - cousin_couples, len(cousins),
+                     size - len(names))
+        following = rng.sample(cousins, wanted)
+        cousin_couples += wanted
+        married = {person for couple in following for person in couple}
+        for child, _ in children:
+            if child in married:
+                continue
+            room = size - len(names) - len(following)
+            outside = cousin_couples < loops or rng.random() < founder_ratio
+            if outside and room >= 2:
+                spouse = add()
+                following.append(
+                    (child, spouse) if rng.random() < 0.5 else (spouse, child)
+                )
+        if not following:
+            break
+        couples = following
+
+    # The last generation's parents have more children until it is full
+    for mother, father in itertools.cycle(couples):
+        if len(names) >= size:
+            break
+        add(mother, father)
+
+    if len(names) != size or cousin_couples != loops:
+        raise ValueError(
+            f"could not build {size} people with {loops} loop(s) in "
+            f"{depth} generations (got {len(names)} with {cousin_couples})"
+        )
+    traits = [
+        heredity.encode_trait(
+            rng.random() < model.emit[g][True]
+        ) if rng.random() < evidence else -1
+        for g in genes
+    ]
+    return heredity.Pedigree(names, mothers, fathers, traits)
+
+
+def count_loops(pedigree):
+    """
+    Return the number of independent loops in `pedigree`: the edges of the
+    graph joining each person to a node for each couple they belong to,
+    less the edges of a spanning forest.
+    """
+    couples = {(pedigree.mothers[i], pedigree.fathers[i])
+               for i in range(len(pedigree)) if pedigree.mothers[i] >= 0}
+    children = sum(1 for i in range(len(pedigree)) if pedigree.mothers[i] >= 0)
+    edges = 2 * len(couples) + children
+    nodes = len(pedigree) + len(couples)
+    leader = {}
+
+    def find(v):
+        leader.setdefault(v, v)
+        while leader[v] != v:
+            leader[v] = leader[leader[v]]
+            v = leader[v]
+        return v
+
+    for i in range(len(pedigree)):
+        find(i)
+        if pedigree.mothers[i] >= 0:
+            couple = (pedigree.mothers[i], pedigree.fathers[i])
+            for person in (i, *couple):
+                leader[find(person)] = find(couple)
+    components = len({find(v) for v in list(leader)})
+    return edges - nodes + components
+
+
+def measure(engine, pedigree, repeat=3, seed=0):
+    """
+    Run `engine` on `pedigree` and return a dictionary of the fastest wall
+    time over `repeat` runs, the peak memory traced by Python during a run
+    (worker processes are not included), the number of gene assignments
+    evaluated where the engine enumerates them, and that run's `Stats`
+    phase timings.
+    """
+    model = heredity.Model()
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        heredity.run_engine(engine, pedigree, model, seed=seed, **OPTIONS)
+        seconds.append(time.perf_counter() - start)
+
+    stats = heredity.Stats()
+    tracemalloc.start()
+    try:
+        heredity.run_engine(
+            engine, pedigree, model, seed=seed, stats=stats, **OPTIONS
+        )
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "engine": engine,
+        "seconds": min(seconds),
+        "peak_bytes": peak,
+        "assignments": stats.counters.get("evaluated"),
+        "phases": stats.seconds
+    }
+
+
+def compare(old, new, tolerance):
+    """
+    Return a description of each (scenario, engine) measurement in report
+    `new` that is slower or uses more memory than in report `old` by more
+    than the fraction `tolerance`, and by more than its `FLOORS` entry.
+    """
+    before = {(r["scenario"], r["engine"]): r for r in old["results"]}
+    regressions = []
+    for result in new["results"]:
+        key = (result["scenario"], result["engine"])
+        if key not in before:
+            continue
+        for field in ("seconds", "peak_bytes"):
+            was, now = before[key][field], result[field]
+            if (was and now > was * (1 + tolerance)
+                    and now - was > FLOORS[field]):
+                regressions.append(
+                    f"{key[0]} {key[1]} {field} {was:g} -> {now:g}"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+import heredity
+
+# Default limit on the total size of stored results
+MAX_BYTES = 64 * 1024 * 1024
+
+# Engine options that change how results are computed but not what they are
+NEUTRAL_OPTIONS = {"stats", "workers", "chunk_size", "compress"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0);
+"""
+
+
+class ResultCache:
+    """
+    On-disk SQLite store of normalized probabilities keyed by
+    `fingerprint`, so a family seen before (under any names and row order)
+    is not inferred again by the same engine. Least recently used results
+    are evicted once their total size exceeds `max_bytes`.
+    """
+
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def get(self, people, model, engine=None):
+        """
+        Return the cached probabilities for `people` under `model` from
+        `engine` (as described to `fingerprint`), or None if they have not
+        been stored.
+        """
+        pedigree = heredity.as_pedigree(people)
+        key, labels = fingerprint(pedigree, model, engine)
+        with self.db:
+            row = self.db.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            self.count("hits" if row else "misses")
+            if row is None:
+                return None
+            self.db.execute(
+                "UPDATE results SET used = ? WHERE key = ?",
+                (time.time_ns(), key)
+            )
+        stored = json.loads(row[0])
+        return {
+            person: {
+                "gene": dict(zip(heredity.GENES, stored[label]["gene"])),
+                "trait": {
+                    True: stored[label]["trait"],
+                    False: 1 - stored[label]["trait"]
+                }
+            }
+            for person, label in zip(pedigree.names, labels)
+        }
+
+    def put(self, people, model, probabilities, engine=None):
+        """
+        Store normalized `probabilities` for `people` under `model` from
+        `engine`, evicting old results if the cache grows past its size
+        limit.
+        """
+        pedigree = heredity.as_pedigree(people)
+        key, labels = fingerprint(pedigree, model, engine)
+        value = json.dumps({
+            label: {
+                "gene": [probabilities[person]["gene"][g]
+                         for g in heredity.GENES],
+                "trait": probabilities[person]["trait"][True]
+            }
+            for person, label in zip(pedigree.names, labels)
+        }, sort_keys=True)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time_ns())
+            )
+            self.evict()
+
+    def evict(self):
+        """
+        Delete least recently used results until the total size fits.
+        """
+        total = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()[0]
+        rows = self.db.execute("SELECT key, size FROM results ORDER BY used")
+        doomed = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM results WHERE key = ?", doomed)
+
+    def count(self, name):
+        """
+        Add one to the hit or miss counter `name`.
+        """
+        self.db.execute(
+            "UPDATE stats SET count = count + 1 WHERE name = ?", (name,)
+        )
+
+    def stats(self):
+        """
+        Return a dictionary of hits, misses, stored entries and bytes.
+        """
+        stats = dict(self.db.execute("SELECT name, count FROM stats"))
+        entries, size = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        stats.update(entries=entries, bytes=size)
+        return stats
+
+
+def cached_run_engine(cache, name, people, model=None, **options):
+    """
+    Like `heredity.run_engine`, but return stored results from `cache`
+    when available and store newly computed ones. Results are only shared
+    between runs of the same engine with the same options, apart from
+    `NEUTRAL_OPTIONS`.
+    """
+    if model is None:
+        model = heredity.Model()
+    engine = (name, sorted(
+        (option, value)
+        for option, value in heredity.engine_options(name, options).items()
+        if option not in NEUTRAL_OPTIONS
+    ))
+    probabilities = cache.get(people, model, engine)
+    if probabilities is None:
+        probabilities = heredity.run_engine(name, people, model, **options)
+        cache.put(people, model, probabilities, engine)
+    return probabilities
+
+
+def fingerprint(pedigree, model, engine=None):
+    """
+    Return (key, labels) for `pedigree` under `model`. `key` is a hash of
+    the family's shape, its traits, the model's tables and `engine`, a
+    description of the engine and options computing the results, that
+    does not depend on names or row order, and `labels[i]` names person i's
+    position in that shape so results can be mapped back onto people.
+
+    People are labelled by colour refinement, which tells apart every
+    pair of non-isomorphic loop-free families. If a family has loops and
+    refinement leaves some people indistinguishable, names are included
+    in the key so unrelated families can never share an entry.
+    """
+    labels, rounds = refine(pedigree)
+    if (len(set(labels)) < len(pedigree)
+            and heredity.has_loops(pedigree)):
+        labels = list(pedigree.names)
+        rounds.append(sorted(labels))
+
+    digest = hashlib.sha256()
+    digest.update(repr(rounds).encode())
+    digest.update(repr(sorted(
+        (labels[i], parent_label(pedigree.mothers[i], labels),
+         parent_label(pedigree.fathers[i], labels), pedigree.traits[i])
+        for i in range(len(pedigree))
+    )).encode())
+    digest.update(repr((model.prior, model.inherit, model.emit)).encode())
+    digest.update(repr(engine).encode())
+    return digest.hexdigest(), [str(label) for label in labels]
+
+
+def parent_label(i, labels):
+    """
+    Return the label of parent `i`, or None for a founder.
+    """
+    return None if i < 0 else labels[i]
+
+
+def family_graph(pedigree):
+    """
+    Return the neighbours of each node in a graph joining every person to
+    a node for each couple they belong to, as a parent or as a child.
+    Nodes 0..n-1 are people and the rest are couples; each neighbour is
+    a (role, node) pair.
+    """
+    couples = {}
+    for i in range(len(pedigree)):
+        if pedigree.mothers[i] >= 0:
+            pair = (pedigree.mothers[i], pedigree.fathers[i])
+            couples.setdefault(pair, []).append(i)
+
+    neighbours = [[] for _ in range(len(pedigree) + len(couples))]
+    for node, ((mother, father), children) in enumerate(
+        couples.items(), len(pedigree)
+    ):
+        neighbours[node].append(("mother", mother))
+        neighbours[node].append(("father", father))
+        neighbours[mother].append(("mother of", node))
+        neighbours[father].append(("father of", node))
+        for child in children:
+            neighbours[node].append(("child", child))
+            neighbours[child].append(("child of", node))
+    return neighbours
+
+
+def refine(pedigree):
+    """
+    Colour the family graph by repeatedly splitting nodes whose neighbours'
+    colours differ, until nothing changes. Return the final colour of each
+    person and the palette of every round, which together identify the
+    shape of the family independently of names.
+    """
+    neighbours = family_graph(pedigree)
+    signatures = [("person", pedigree.traits[i]) for i in range(len(pedigree))]
+    signatures += [("couple",)] * (len(neighbours) - len(pedigree))
+    rounds = []
+    classes = 0
+    while True:
+        palette = sorted(set(signatures))
+        rounds.append(palette)
+        index = {signature: c for c, signature in enumerate(palette)}
+        colors = [index[signature] for signature in signatures]
+        if len(palette) == classes:
+            return colors[:len(pedigree)], rounds
+        classes = len(palette)
+        signatures = [
+            (colors[v], tuple(sorted(
+                (role, colors[u]) for role, u in neighbours[v]
+            )))
+            for v in range(len(neighbours))
+        ]
+
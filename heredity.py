@@ -1,6 +1,21 @@
+import argparse
+import contextlib
 import csv
+import heapq
+import inspect
 import itertools
+import json
+import math
+import os
 import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 PROBS = {
 
@@ -36,56 +51,181 @@ PROBS = {
     "mutation": 0.01
 }
 
+# Possible number of copies of the gene a person can have
+GENES = (0, 1, 2)
+
+# Number of assignments handled per NumPy call or parallel task
+CHUNK_SIZE = 65536
+
+# Default number of Gibbs sampling chains, sweeps per chain and fraction
+# of the run discarded as burn-in
+CHAINS = 8
+SWEEPS = 1000
+BURN_IN = 0.1
+
+# Columns holding the traits of several genes start with this
+LOCUS_PREFIX = "trait_"
+
 
 def main():
 
     # Check for proper usage
-    if len(sys.argv) != 2:
-        sys.exit("Usage: python heredity.py data.csv")
-    people = load_data(sys.argv[1])
+    parser = argparse.ArgumentParser(
+        description="Infer gene and trait probabilities for a family."
+    )
+    parser.add_argument("data", help="CSV file with name,mother,father,trait")
+    parser.add_argument(
+        "--engine", choices=sorted(ENGINES),
+        help="inference engine (default: peel; enumerate is the brute-force "
+             "reference)"
+    )
+    parser.add_argument(
+        "--mutation", type=float, default=PROBS["mutation"],
+        help="probability that a passed gene mutates"
+    )
+    parser.add_argument(
+        "--workers", type=int,
+        help="worker processes for the parallel engine (default: CPUs)"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=CHUNK_SIZE,
+        help="assignments per batch or parallel task"
+    )
+    parser.add_argument(
+        "--no-compress", dest="compress", action="store_false",
+        help="enumerate exchangeable siblings one by one"
+    )
+    parser.add_argument(
+        "--epsilon", type=float,
+        help="prune search branches less likely than this"
+    )
+    parser.add_argument(
+        "--chains", type=int, default=CHAINS,
+        help="chains run at once by the gibbs engine"
+    )
+    parser.add_argument(
+        "--sweeps", type=int, default=SWEEPS,
+        help="sweeps over the family per chain for the gibbs engine"
+    )
+    parser.add_argument(
+        "--burn-in", type=float, default=BURN_IN,
+        help="fraction of the gibbs engine's run discarded as burn-in"
+    )
+    parser.add_argument(
+        "--seconds", type=float,
+        help="stop the gibbs engine after this long"
+    )
+    parser.add_argument(
+        "--seed", type=int, help="random seed for the gibbs engine"
+    )
+    parser.add_argument(
+        "--targets", nargs="+", metavar="NAME",
+        help="only infer these people, from the part of the family they "
+             "depend on (always peeled)"
+    )
+    parser.add_argument(
+        "--loci", action="store_true",
+        help="infer every trait_<locus> column as an independent gene"
+    )
+    parser.add_argument(
+        "--stats", help="file to write counters and phase timings to as JSON"
+    )
+    parser.add_argument(
+        "--trace", help="file to write traced events to, one JSON per line"
+    )
+    args = parser.parse_args()
+    if args.sweeps < 2:
+        parser.error("--sweeps must be at least 2")
+    if not 0 <= args.burn_in < 1:
+        parser.error("--burn-in must be at least 0 and less than 1")
+    if (args.targets or args.loci) and args.engine not in (None, "peel"):
+        parser.error("--targets and --loci always use the peel engine")
+    model = Model(dict(PROBS, mutation=args.mutation))
 
-    # Keep track of gene and trait probabilities for each person
-    probabilities = {
-        person: {
-            "gene": {
-                2: 0,
-                1: 0,
-                0: 0
-            },
-            "trait": {
-                True: 0,
-                False: 0
-            }
-        }
-        for person in people
-    }
+    # Instrumentation costs nothing unless asked for
+    trace = open(args.trace, "w") if args.trace else None
 
-    # Loop over all sets of people who might have the trait
-    names = set(people)
-    for have_trait in powerset(names):
+    def write_event(event):
+        trace.write(json.dumps(event) + "\n")
 
-        # Check if current set of people violates known information
-        fails_evidence = any(
-            (people[person]["trait"] is not None and
-             people[person]["trait"] != (person in have_trait))
-            for person in names
-        )
-        if fails_evidence:
-            continue
-        
-        # Loop over all sets of people who might have the gene
-        for one_gene in powerset(names):
-            for two_genes in powerset(names - one_gene):
+    if args.stats or trace:
+        stats = Stats(write_event if trace else None)
+    else:
+        stats = NO_STATS
 
-                # Update probabilities with new joint probability
-                p = joint_probability(people, one_gene, two_genes, have_trait)
-                update(probabilities, one_gene, two_genes, have_trait, p)
+    try:
+        infer(args, model, stats)
+    except PedigreeError as e:
+        sys.exit(f"{args.data}: {e}")
+    finally:
+        if trace:
+            trace.close()
+    if args.stats:
+        with open(args.stats, "w") as f:
+            f.write(stats.to_json() + "\n")
 
-    # Ensure probabilities sum to 1
-    normalize(probabilities)
 
-    # Print results
-    for person in people:
+def infer(args, model, stats):
+    """
+    Print the probabilities asked for on the command line by `args`.
+    """
+
+    # Every locus shares one pass over the whole file
+    if args.loci:
+        with stats.phase("load"):
+            people = load_data(args.data)
+        if not all("loci" in person for person in people.values()):
+            sys.exit(f"{args.data}: --loci needs {LOCUS_PREFIX}<locus> "
+                     f"columns")
+        stats.count("people", len(people))
+        with stats.phase("peel"):
+            results = locus_probabilities(people, model)
+        for locus, probabilities in results.items():
+            print(f"Locus {locus}:")
+            print_probabilities(probabilities, people)
+        return
+
+    # Unrelated families are independent, so infer each one separately
+    families = iter_families(args.data)
+    found = set()
+    while True:
+        with stats.phase("load"):
+            people = next(families, None)
+        if people is None:
+            break
+        stats.count("families")
+        stats.count("people", len(people))
+
+        # Compute normalized gene and trait probabilities for each person
+        if args.targets:
+            names = [name for name in args.targets if name in people.index]
+            if not names:
+                continue
+            found.update(names)
+            probabilities = query(people, names, model=model)
+        else:
+            names = people.names
+            probabilities = run_engine(
+                args.engine or "peel", people, model,
+                workers=args.workers, chunk_size=args.chunk_size,
+                compress=args.compress, epsilon=args.epsilon,
+                chains=args.chains, sweeps=args.sweeps, burn_in=args.burn_in,
+                seconds=args.seconds, seed=args.seed, stats=stats
+            )
+
+        # Print results
+        print_probabilities(probabilities, names)
+
+    missing = [name for name in args.targets or () if name not in found]
+    if missing:
+        sys.exit(f"{args.data}: no one called {', '.join(missing)}")
+
+
+def print_probabilities(probabilities, names):
+    """
+    Print the gene and trait distributions of each person in `names`.
+    """
+    for person in names:
         print(f"{person}:")
         for field in probabilities[person]:
             print(f"  {field.capitalize()}:")
@@ -100,22 +240,392 @@ def load_data(filename):
     File assumed to be a CSV containing fields name, mother, father, trait.
     mother, father must both be blank, or both be valid names in the CSV.
     trait should be 0 or 1 if trait is known, blank otherwise.
+    Every row breaking these rules is reported at once by `validate`.
+    Each "trait_<locus>" column holds the trait of another gene, stored in
+    the person's "loci" dictionary by locus name.
     """
     data = dict()
+    rows = []
+    lines = []
     with open(filename) as f:
         reader = csv.DictReader(f)
+        loci = locus_columns(reader.fieldnames)
         for row in reader:
+            rows.append(parse_row(row))
+            lines.append(reader.line_num)
             name = row["name"]
             data[name] = {
                 "name": name,
                 "mother": row["mother"] or None,
                 "father": row["father"] or None,
-                "trait": (True if row["trait"] == "1" else
-                          False if row["trait"] == "0" else None)
+                "trait": parse_trait(row.get("trait"))
             }
+            if loci:
+                data[name]["loci"] = {
+                    locus: parse_trait(row[column])
+                    for locus, column in loci.items()
+                }
+    validate(rows, lines)
     return data
 
 
+def parse_trait(value):
+    """
+    Return the trait in a CSV cell: True for "1", False for "0" and None
+    if it is blank or missing.
+    """
+    return True if value == "1" else False if value == "0" else None
+
+
+def locus_columns(fieldnames):
+    """
+    Return a dictionary from locus name to column for each "trait_<locus>"
+    column in `fieldnames`, giving the traits of several independent genes.
+    """
+    return {
+        column[len(LOCUS_PREFIX):]: column
+        for column in fieldnames or ()
+        if column.startswith(LOCUS_PREFIX)
+    }
+
+
+class Pedigree:
+    """
+    Integer-indexed, array-backed family. Person i is called `names[i]`,
+    has parents `mothers[i]` and `fathers[i]` (-1 for founders) and trait
+    `traits[i]` (1 has it, 0 does not, -1 unknown).
+
+    The structure engines walk is computed once here: `order` lists
+    people generation by generation, so parents always come before their
+    children, and `children[i]` lists the children of person i. Both are
+    computed by `sort_generations` unless given.
+    """
+
+    __slots__ = ("names", "index", "mothers", "fathers", "traits", "order",
+                 "children")
+
+    def __init__(self, names, mothers, fathers, traits, order=None,
+                 children=None):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.mothers = array("q", mothers)
+        self.fathers = array("q", fathers)
+        self.traits = array("b", traits)
+        if order is None:
+            order, children = sort_generations(self.mothers, self.fathers)
+            if len(order) != len(self.names):
+                raise ValueError("pedigree contains a cycle")
+        elif children is None:
+            children = child_lists(self.mothers, self.fathers)
+        self.order = array("q", order)
+        self.children = children
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_people(cls, people):
+        """
+        Build a pedigree from a `load_data` dictionary.
+        """
+        names = list(people)
+        index = {name: i for i, name in enumerate(names)}
+        mothers = []
+        fathers = []
+        for name in names:
+            family = parents(people, name)
+            mothers.append(-1 if family is None else index[family[0]])
+            fathers.append(-1 if family is None else index[family[1]])
+        traits = [encode_trait(people[name]["trait"]) for name in names]
+        return cls(names, mothers, fathers, traits)
+
+    def to_people(self):
+        """
+        Return the pedigree as a `load_data` dictionary.
+        """
+        return {
+            name: {
+                "name": name,
+                "mother": self.parent_name(self.mothers[i]),
+                "father": self.parent_name(self.fathers[i]),
+                "trait": self.trait(i)
+            }
+            for i, name in enumerate(self.names)
+        }
+
+    def parent_name(self, i):
+        """
+        Return the name of person `i`, or None if `i` is -1.
+        """
+        return None if i < 0 else self.names[i]
+
+    def trait(self, i):
+        """
+        Return person `i`'s trait as True, False or None if unknown.
+        """
+        return decode_trait(self.traits[i])
+
+
+def encode_trait(trait):
+    """
+    Return the `Pedigree.traits` code for a True, False or None trait.
+    """
+    return -1 if trait is None else int(trait)
+
+
+def decode_trait(code):
+    """
+    Return the True, False or None trait for a `Pedigree.traits` code.
+    """
+    return None if code < 0 else bool(code)
+
+
+def child_lists(mothers, fathers):
+    """
+    Return the children of each person, given parent indices (-1 for an
+    unknown parent).
+    """
+    children = [[] for _ in mothers]
+    for i, (mother, father) in enumerate(zip(mothers, fathers)):
+        for parent in {mother, father} - {-1}:
+            children[parent].append(i)
+    return children
+
+
+def sort_generations(mothers, fathers):
+    """
+    Return (order, children): person indices ordered by generation
+    (founders first, then each person one generation below their latest
+    parent), so that parents precede their children, and `child_lists`.
+    People on a cycle of parents, and their descendants, are left out of
+    `order`.
+    """
+    children = child_lists(mothers, fathers)
+    waiting = [len({mother, father} - {-1})
+               for mother, father in zip(mothers, fathers)]
+    generation = [i for i in range(len(mothers)) if waiting[i] == 0]
+    order = []
+    while generation:
+        order.extend(generation)
+        following = []
+        for i in generation:
+            for child in children[i]:
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    following.append(child)
+        generation = sorted(following)
+    return order, children
+
+
+class PedigreeError(ValueError):
+    """
+    Raised by `validate` with every problem found in a pedigree, each
+    naming the line of the file it is on.
+    """
+
+    def __init__(self, problems):
+        self.problems = list(problems)
+
+        # Kept as the only argument so the error survives pickling
+        super().__init__(self.problems)
+
+    def __str__(self):
+        return (f"{len(self.problems)} problem(s) in pedigree:\n  " +
+                "\n  ".join(self.problems))
+
+
+def validate(rows, lines=None):
+    """
+    Check (name, mother, father, trait) rows for duplicate names, rows
+    with only one parent, parents without a row and people who are their
+    own ancestors, and raise a `PedigreeError` listing all of them.
+    `lines[k]` is the line of the file row k was read from; by default
+    rows are numbered from line 2, after the header.
+
+    Return (mothers, fathers, order, children) for a valid pedigree, as
+    taken by `Pedigree`, so the sort made here is not repeated.
+    """
+    if lines is None:
+        lines = range(2, len(rows) + 2)
+    problems = []
+    index = {}
+    for k, (name, _, _, _) in enumerate(rows):
+        if name in index:
+            problems.append((lines[k], f"duplicate name {name!r}, first on "
+                                       f"line {lines[index[name]]}"))
+        else:
+            index[name] = k
+
+    # Parents of the rows that can be placed in a family
+    mothers = [-1] * len(rows)
+    fathers = [-1] * len(rows)
+    for k, (name, mother, father, _) in enumerate(rows):
+        if (mother is None) != (father is None):
+            missing = "father" if father is None else "mother"
+            problems.append((lines[k], f"{name} has only one parent "
+                                       f"(no {missing})"))
+            continue
+        if mother is None or index[name] != k:
+            continue
+        absent = [f"{role} {parent!r}"
+                  for role, parent in (("mother", mother), ("father", father))
+                  if parent not in index]
+        if absent:
+            problems.append((lines[k], f"{name}'s {' and '.join(absent)} "
+                             f"{'has' if len(absent) == 1 else 'have'} "
+                             f"no row"))
+            continue
+        mothers[k], fathers[k] = index[mother], index[father]
+
+    # People left out of the generation order, minus their descendants,
+    # are on a cycle
+    order, children = sort_generations(mothers, fathers)
+    remaining = set(range(len(rows))) - set(order)
+    leaves = [k for k in remaining
+              if not remaining.intersection(children[k])]
+    while leaves:
+        remaining.difference_update(leaves)
+        leaves = [parent for k in leaves
+                  for parent in {mothers[k], fathers[k]} & remaining
+                  if not remaining.intersection(children[parent])]
+    for k in sorted(remaining):
+        problems.append((lines[k], f"{rows[k][0]} is their own ancestor"))
+
+    if problems:
+        raise PedigreeError(f"line {line}: {problem}"
+                            for line, problem in sorted(problems))
+    return mothers, fathers, order, children
+
+
+def parse_row(row):
+    """
+    Return (name, mother, father, trait) for a CSV row in the `load_data`
+    format, with blank parents as None and the trait encoded as in
+    `Pedigree.traits`.
+    """
+    return (
+        row["name"],
+        row["mother"] or None,
+        row["father"] or None,
+        encode_trait(parse_trait(row.get("trait")))
+    )
+
+
+def numbered_rows(reader, rows):
+    """
+    Return (rows, lines) for the CSV `rows` read by `reader`: each row
+    parsed by `parse_row`, and the line of the file it was read from.
+    """
+    parsed = []
+    lines = []
+    for row in rows:
+        parsed.append(parse_row(row))
+        lines.append(reader.line_num)
+    return parsed, lines
+
+
+def pedigree_from_rows(rows, lines=None):
+    """
+    Build a `Pedigree` from (name, mother, father, trait) rows, after
+    checking them with `validate`.
+    """
+    mothers, fathers, order, children = validate(rows, lines)
+    return Pedigree([row[0] for row in rows], mothers, fathers,
+                    [row[3] for row in rows], order, children)
+
+
+def split_families(rows, lines=None):
+    """
+    Split (name, mother, father, trait) rows into families of people
+    connected through mother/father links, and yield a `Pedigree` for
+    each in order of their first row. Every problem with the rows, found
+    by `validate`, is reported before any family is built.
+    """
+    rows = list(rows)
+    if lines is None:
+        lines = range(2, len(rows) + 2)
+    validate(rows, lines)
+    leader = {row[0]: row[0] for row in rows}
+
+    def find(name):
+        while leader[name] != name:
+            leader[name] = leader[leader[name]]
+            name = leader[name]
+        return name
+
+    for name, mother, father, _ in rows:
+        for parent in (mother, father):
+            if parent is not None:
+                leader[find(parent)] = find(name)
+
+    families = {}
+    for row, line in zip(rows, lines):
+        family = families.setdefault(find(row[0]), ([], []))
+        family[0].append(row)
+        family[1].append(line)
+    for family, family_lines in families.values():
+        yield pedigree_from_rows(family, family_lines)
+
+
+def iter_families(filename):
+    """
+    Read a CSV in the `load_data` format and yield each family (people
+    connected through mother/father links) as its own `Pedigree`.
+    Unrelated families are independent, so each can be inferred on its own.
+
+    If the CSV has a `family` column, each family's rows must be next to
+    each other; the file is then streamed and a family is yielded as soon
+    as its last row is read, so memory is bounded by the largest family.
+    Otherwise the whole file is read before it is split.
+
+    Files converted by `pedfile` are read from their memory-mapped
+    arrays instead, one family at a time.
+    """
+    import pedfile
+    if pedfile.is_pedfile(filename):
+        with pedfile.PedigreeFile(filename) as registry:
+            for family in registry:
+                yield Pedigree(*family)
+        return
+
+    with open(filename) as f:
+        reader = csv.DictReader(f)
+        if "family" not in (reader.fieldnames or ()):
+            yield from split_families(*numbered_rows(reader, reader))
+            return
+
+        # Line of each family's first row
+        seen = {}
+        for family, group in itertools.groupby(
+            reader, key=lambda row: row["family"]
+        ):
+            if family in seen:
+                raise PedigreeError([
+                    f"line {reader.line_num}: rows of family {family!r} "
+                    f"are not together (first on line {seen[family]})"
+                ])
+            seen[family] = reader.line_num
+            yield from split_families(*numbered_rows(reader, group))
+
+
+def as_pedigree(people):
+    """
+    Return `people` as a `Pedigree`, converting a `load_data` dictionary.
+    """
+    if isinstance(people, Pedigree):
+        return people
+    return Pedigree.from_people(people)
+
+
+def as_people(people):
+    """
+    Return `people` as a `load_data` dictionary, converting a `Pedigree`.
+    """
+    if isinstance(people, Pedigree):
+        return people.to_people()
+    return people
+
+
 def powerset(s):
     """
     Return a list of all possible subsets of set s.
@@ -128,8 +638,261 @@ def powerset(s):
     ]
 
 
-def joint_probability(people, one_gene, two_genes, have_trait):
-    
+def gene_assignments(names, prefix=()):
+    """
+    Yield every (one_gene, two_genes) pair of disjoint subsets of `names`,
+    one at a time rather than as a list. If given, `prefix` fixes the gene
+    counts of the first people in `names`, selecting one shard of the space.
+    """
+    names = list(names)
+    prefix = tuple(prefix)
+    for rest in itertools.product(GENES, repeat=len(names) - len(prefix)):
+        counts = prefix + rest
+        one_gene = {name for name, genes in zip(names, counts) if genes == 1}
+        two_genes = {name for name, genes in zip(names, counts) if genes == 2}
+        yield one_gene, two_genes
+
+
+def empty_probabilities(people, value=0):
+    """
+    Return a `probabilities` dictionary with every entry set to `value`.
+    """
+    return {
+        person: {
+            "gene": {
+                2: value,
+                1: value,
+                0: value
+            },
+            "trait": {
+                True: value,
+                False: value
+            }
+        }
+        for person in people
+    }
+
+
+def parents(people, person):
+    """
+    Return the (mother, father) of `person`, or None for a founder.
+    """
+    mother = people[person]["mother"]
+    father = people[person]["father"]
+    if mother is None or father is None:
+        return None
+    return mother, father
+
+
+def pass_probability(genes, probs=PROBS):
+    """
+    Return the probability that a parent with `genes` copies of the gene
+    passes one copy on to a child.
+    """
+    if genes == 2:
+        return 1 - probs["mutation"]
+    if genes == 1:
+        return 0.5
+    return probs["mutation"]
+
+
+def inheritance_probability(genes, mother_genes, father_genes, probs=PROBS):
+    """
+    Return the probability that a child has `genes` copies of the gene
+    given how many copies its mother and father have.
+    """
+    from_mother = pass_probability(mother_genes, probs)
+    from_father = pass_probability(father_genes, probs)
+    if genes == 2:
+        return from_mother * from_father
+    if genes == 1:
+        return (from_mother * (1 - from_father) +
+                (1 - from_mother) * from_father)
+    return (1 - from_mother) * (1 - from_father)
+
+
+def log(p):
+    """
+    Return the natural logarithm of `p`, or -inf if `p` is 0.
+    """
+    return math.log(p) if p > 0 else -math.inf
+
+
+def log_sum(a, b):
+    """
+    Return log(exp(a) + exp(b)) without leaving log space.
+    """
+    if a < b:
+        a, b = b, a
+    if b == -math.inf:
+        return a
+    return a + math.log1p(math.exp(b - a))
+
+
+class Model:
+    """
+    Probability tables compiled once from a `PROBS`-shaped config.
+    `prior[g]` is the unconditional probability of g copies of the gene,
+    `inherit[g][m][f]` the probability of a child having g copies given a
+    mother with m and a father with f, and `emit[g][t]` the probability
+    of trait t given g copies. The `log_` tables hold the same values as
+    natural logarithms.
+    """
+
+    __slots__ = ("probs", "prior", "inherit", "emit",
+                 "log_prior", "log_inherit", "log_emit", "_arrays")
+
+    def __init__(self, probs=PROBS):
+        self.probs = probs
+        self.prior = tuple(probs["gene"][g] for g in GENES)
+        self.inherit = tuple(
+            tuple(
+                tuple(inheritance_probability(g, m, f, probs) for f in GENES)
+                for m in GENES
+            )
+            for g in GENES
+        )
+        self.emit = tuple(
+            (probs["trait"][g][False], probs["trait"][g][True]) for g in GENES
+        )
+        self.log_prior = tuple(log(p) for p in self.prior)
+        self.log_inherit = tuple(
+            tuple(tuple(log(p) for p in row) for row in table)
+            for table in self.inherit
+        )
+        self.log_emit = tuple(tuple(log(p) for p in row) for row in self.emit)
+        self._arrays = None
+
+    def arrays(self):
+        """
+        Return the (prior, inherit, emit) tables as NumPy arrays.
+        """
+        if self._arrays is None:
+            require_numpy()
+            self._arrays = (
+                np.array(self.prior),
+                np.array(self.inherit),
+                np.array(self.emit)
+            )
+        return self._arrays
+
+
+class Stats:
+    """
+    Counters and per-phase timers filled in by the engines that accept a
+    `stats` argument. Counters record gene assignments "generated",
+    "pruned" (ruled out by the evidence, so never added up) and
+    "evaluated"; `seconds` holds the time spent in phases such as "load",
+    "enumerate", "update" and "normalize", and `values` other results
+    such as the convergence of sampling. If given, `sink` is called with
+    a dictionary for every traced event.
+    """
+
+    enabled = True
+
+    def __init__(self, sink=None):
+        self.counters = {}
+        self.seconds = {}
+        self.values = {}
+        self.sink = sink
+
+    def count(self, name, n=1):
+        """
+        Add `n` to the counter `name`.
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def time(self, name, seconds):
+        """
+        Add `seconds` to the time spent in phase `name`.
+        """
+        self.seconds[name] = self.seconds.get(name, 0) + seconds
+
+    def note(self, name, value):
+        """
+        Record `value` as `name`, replacing any earlier value.
+        """
+        self.values[name] = value
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Time the body of a `with` statement as phase `name`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.time(name, time.perf_counter() - start)
+
+    def trace(self, event, **fields):
+        """
+        Send `event` with `fields` to the sink, if there is one.
+        """
+        if self.sink is not None:
+            self.sink(dict(fields, event=event))
+
+    def merge(self, other):
+        """
+        Add the counters and timers of `other`, such as those of a shard
+        computed in another process.
+        """
+        for name, n in other.counters.items():
+            self.count(name, n)
+        for name, seconds in other.seconds.items():
+            self.time(name, seconds)
+        self.values.update(other.values)
+
+    def to_json(self):
+        """
+        Return the counters, timers and values as a JSON object.
+        """
+        return json.dumps(
+            {"counters": self.counters, "seconds": self.seconds,
+             "values": self.values},
+            sort_keys=True
+        )
+
+
+class NullStats(Stats):
+    """
+    `Stats` that records nothing, used when instrumentation is off.
+    """
+
+    enabled = False
+
+    def count(self, name, n=1):
+        pass
+
+    def time(self, name, seconds):
+        pass
+
+    def note(self, name, value):
+        pass
+
+    def phase(self, name):
+        return contextlib.nullcontext()
+
+    def trace(self, event, **fields):
+        pass
+
+
+# Shared by every engine run without a `stats` argument
+NO_STATS = NullStats()
+
+
+def gene_count(person, one_gene, two_genes):
+    """
+    Return how many copies of the gene `person` has in an assignment.
+    """
+    if person in two_genes:
+        return 2
+    if person in one_gene:
+        return 1
+    return 0
+
+
+def joint_probability(people, one_gene, two_genes, have_trait, model=None):
     """
     Compute and return a joint probability.
 
@@ -139,494 +902,90 @@ def joint_probability(people, one_gene, two_genes, have_trait):
         * everyone not in `one_gene` or `two_gene` does not have the gene, and
         * everyone in set `have_trait` has the trait, and
         * everyone not in set` have_trait` does not have the trait.
-        
-        Step 1 - Identify who has 0 genes
-        Step 2 for person in people:
-        Start with all people who dont have parents
-        Step 3 If Person has 0 gene- 
-            - If Person doesnt have parents && no Trait then  PROBS["gene"][0] * PROBS["trait"][0][False]
-              If P0 doesnt have parents && YES Trait then  PROBS["gene"][0] * PROBS["trait"][0][True]
-        Step 4 If Person has 1 gene- 
-            - If Person doesnt have parents && no Trait then  PROBS["gene"][1] * PROBS["trait"][1][False]
-              If P0 doesnt have parents && YES Trait then  PROBS["gene"][1] * PROBS["trait"][1][True]
-        Step 5 - If person has 2 genes.....
-        
-        If person has parents
-        
-        
-        
-        Loop all people who have parents and break into several cases:
-
-            child has one gene
-            
-                from mother, so not from father
-            
-                    mother cases (p1)
-            
-                        has one gene: 0.5 (pass one gene)
-            
-                        has two gene: 0.99 (minus mutation)
-            
-                        has no gene: 0.01(mutation)
-            
-                    father cases (p2)
-            
-                        has one gene: 0.5 (pass no gene)
-            
-                        has two gene: 0.01 (mutation)
-            
-                        has no gene: 0.99 (minus mutation)
-            
-                from father, so not from mother
-                        father cases (p3)
-            
-                            has one gene: 0.5 (pass one gene)
-            
-                            has two gene: 0.99 (minus mutation)
-            
-                            has no gene: 0.01(mutation)
-                        mother cases(p4)
-                            has one gene: 0.5 (pass no gene)
-            
-                            has two gene: 0.01 (mutation)
-            
-                            has no gene: 0.99 (minus mutation)
-            
-                    (like above, but exchange the role) (p3 and p4)
-                    what does this mean??????
-            
-                => ( p1 x p2 + p3 x p4 ) x trait
-            
-            child has two gene (parents should pass one gene individually)
-            
-                mother (p1)
-            
-                    has one gene: 0.5 (pass one gene)
-            
-                    has two gene: 0.99 (minus mutation) 
-            
-                    has no gene: 0.01 (mutation)
-            
-                father (p2)
-            
-                    (same as above)
-            
-                => ( p1 x p2 ) x trait
-            
-            child has no gene (parents should not pass gene)
-            
-                mother (p1)
-            
-                    has one gene: 0.5 (pass no gene)
-            
-                    has two gene: 0.01 (mutation)
-            
-                    has no gene: 0.99(except mutation)
-            
-                father (p2)
-            
-                    (same as above)
-            
-                => ( p1 x p2 ) x trait
-
-
-        
-        New Algorithm
-        Loop all people who have parents and break into several cases:
-
-            child has one gene
-            
-                from mother, so not from father
-            
-                    mother cases (p1)
-            
-                        has one gene: 0.5 (pass one gene)
-            
-                        has two gene: 0.99 (minus mutation)
-            
-                        has no gene: 0.01(mutation)
-            
-                    father cases (p2)
-            
-                        has one gene: 0.5 (pass no gene)
-            
-                        has two gene: 0.01 (mutation)
-            
-                        has no gene: 0.99 (minus mutation)
-            
-                from father, so not from mother
-                        father cases (p3)
-            
-                            has one gene: 0.5 (pass one gene)
-            
-                            has two gene: 0.99 (minus mutation)
-            
-                            has no gene: 0.01(mutation)
-                        mother cases(p4)
-                            has one gene: 0.5 (pass no gene)
-            
-                            has two gene: 0.01 (mutation)
-            
-                            has no gene: 0.99 (minus mutation)
-            
-                    (like above, but exchange the role) (p3 and p4)
-                    what does this mean??????
-            
-                => ( p1 x p2 + p3 x p4 ) x trait
-            
-            child has two gene (parents should pass one gene individually)
-            
-                mother (p1)
-            
-                    has one gene: 0.5 (pass one gene)
-            
-                    has two gene: 0.99 (minus mutation) 
-            
-                    has no gene: 0.01 (mutation)
-            
-                father (p2)
-            
-                    (same as above)
-            
-                => ( p1 x p2 ) x trait
-            
-            child has no gene (parents should not pass gene)
-            
-                mother (p1)
-            
-                    has one gene: 0.5 (pass no gene)
-            
-                    has two gene: 0.01 (mutation)
-            
-                    has no gene: 0.99(except mutation)
-            
-                father (p2)
-            
-                    (same as above)
-            
-                => ( p1 x p2 ) x trait
-        
-        
-        
-        
-    """
-    calculation=1.0
-    zero_gene=set()
-    for person in people:
-        if person not in one_gene and person not in two_genes:
-            print("********************this is person", person)
-            zero_gene.add(person)
-    print("zero gene", zero_gene)
-    print("one gene", one_gene)
-    print("2 genes",  two_genes)
-    print("have trait",have_trait)
-    
-    '''       
-    for person in zero_gene:
-        if people[person]["mother"] is  None  and people[person]["father"] is  None and people[person]["trait"]==0:
-            calculation=PROBS["gene"][0] * PROBS["trait"][0][False]*calculation
-            print("zero gene, no parent, no trait", calculation)
-            print("person - ", person)
-        if person[1] is not None  and person[2] is not None and person[3]==1:
-            print("b")
-            calculation=PROBS["gene"][0] * PROBS["trait"][0][True]*calculation
-    for person in one_gene:
-        print ("one gene")
-        print("person - ", people[person])
-        if people[person]["mother"] is  None  and people[person]["father"] is  None and people[person]["trait"]==0:
-            print("one gene, no parent, no trait", calculation)
-            print("person - ", people[person])
-            calculation=PROBS["gene"][1] * PROBS["trait"][1][False]*calculation
-        if people[person]["mother"] is  None  and people[person]["father"] is  None and people[person]["trait"]==1:
-            print("********one gene, no parent, YES trait", calculation)
-            print("person - ", people[person])
-            calculation=PROBS["gene"][1] * PROBS["trait"][1][True]*calculation
-        
-    for person in two_genes:
-        print ("two genes")
-        print("person - ", people[person])
-        if person[1] is not None  and person[2] is not None and person[3]==0:
-            print("two gene, no parent, no trait", calculation)
-            print("person - ", people[person])
-            calculation=PROBS["gene"][2] * PROBS["trait"][2][False]*calculation
-        if person[1] is not None  and person[2] is not None and person[3]==1:
-            print("f")
-            calculation=PROBS["gene"][2] * PROBS["trait"][2][True]*calculation
-        print(calculation*5)
-    '''
+
+    Probabilities are read from `model`, compiled from `PROBS` if omitted.
+    """
+    if model is None:
+        model = Model()
+    probability = 1
     for person in people:
-        counter=0
-        if person in one_gene:
-            #calculatign if the has no parents:
-            if people[person]["mother"] is  None  and people[person]["father"] is  None and people[person]["trait"]==0:
-                print("one gene, no parent, no trait", calculation)
-                print("person - ", people[person])
-                calculation=PROBS["gene"][1] * PROBS["trait"][1][False]*calculation
-                counter+=1
-            if people[person]["mother"] is  None  and people[person]["father"] is  None and people[person]["trait"]==1:
-                print("********one gene, no parent, YES trait", calculation)
-                print("person - ", people[person])
-                calculation=PROBS["gene"][1] * PROBS["trait"][1][True]*calculation
-                counter+=1
-            if counter==0:
-                '''
-                child has one gene
-            
-                from mother, so not from father
-            
-                    mother cases (p1)
-            
-                        has one gene: 0.5 (pass one gene)
-            
-                        has two gene: 0.99 (minus mutation)
-            
-                        has no gene: 0.01(mutation)
-            
-                    father cases (p2)
-            
-                        has one gene: 0.5 (pass no gene)
-            
-                        has two gene: 0.01 (mutation)
-            
-                        has no gene: 0.99 (minus mutation)
-            
-                from father, so not from mother
-                        father cases (p3)
-            
-                            has one gene: 0.5 (pass one gene)
-            
-                            has two gene: 0.99 (minus mutation)
-            
-                            has no gene: 0.01(mutation)
-                        mother cases(p4)
-                            has one gene: 0.5 (pass no gene)
-            
-                            has two gene: 0.01 (mutation)
-            
-                            has no gene: 0.99 (minus mutation)
-            
-                    (like above, but exchange the role) (p3 and p4)
-                    what does this mean??????
-            
-                => ( p1 x p2 + p3 x p4 ) x trait
-                '''
-                #chekning if came from mom and not from dad:
-                if people[person]["mother"] in zero_gene:
-                    p1=0.01
-                    p4=0.99
-                if people[person]["father"] in zero_gene:
-                    p2=0.99
-                    p3=0.01
-                if people[person]["mother"] in one_gene:
-                    p1=0.5
-                    p4=0.5
-                if people[person]["father"] in one_gene:
-                    p2=0.5
-                    p3=0.5
-                if people[person]["mother"] in two_genes:
-                    p1=0.99
-                    p4=0.01
-                if people[person]["father"] in two_genes:
-                    p2=0.01
-                    p3=0.99
-                if person in have_trait:
-                    calculation=(p1*p2+p3*p4)*PROBS["trait"][1][True]*calculation
-                else:
-                    calculation=(p1*p2+p3*p4)*PROBS["trait"][1][False]*calculation
-                 
-                
-        if person in two_genes:
-            if people[person]["mother"] is not None  and people[person]["father"] is not None and people[person]["trait"]==0:
-                print("two gene, no parent, no trait", calculation)
-                print("person - ", people[person])
-                calculation=PROBS["gene"][2] * PROBS["trait"][2][False]*calculation
-                counter+=1
-            if people[person]["mother"] is not None  and people[person]["father"] is not None and people[person]["trait"]==1:
-                calculation=PROBS["gene"][2] * PROBS["trait"][2][True]*calculation
-                counter+=1
-            if counter==0:
-            #UNIMPLEMENTED
-                #calculating the genes of mom
-                p1=1.0
-                p2=1.0
-                if people[person]["mother"] in zero_gene:
-                    p1= 0.01
-                if people[person]["mother"] in one_gene:
-                    p1=0.5
-                if people[person]["mother"] in two_genes:
-                    p1=0.99
-                #calculating the prob for gene for father:
-                if people[person]["father"] in zero_gene:
-                    p2=0.01
-                if people[person]["father"] in one_gene:
-                    p2=0.5
-                if people[person]["father"] in two_genes:
-                    p2=0.99
-                if person in have_trait:
-                    calculation=(p1*p2)*PROBS["trait"][2][True]*calculation
-                else:
-                    calculation=(p1*p2)*PROBS["trait"][2][False]*calculation
-            
-            
-        if person in zero_gene:
-            if people[person]["mother"] is  None  and people[person]["father"] is  None and people[person]["trait"]==0:
-                calculation=PROBS["gene"][0] * PROBS["trait"][0][False]*calculation
-                counter+=1
-                print("zero gene, no parent, no trait", calculation)
-                print("person - ", person)
-            if people[person]["mother"] is not None  and people[person]["father"] is not None and people[person]["trait"]==1:
-                print("b")
-                calculation=PROBS["gene"][0] * PROBS["trait"][0][True]*calculation
-                counter+=1
-            ## missing scenario if they have parents
-            if counter==0:
-                #calculating the genes of mom
-                if people[person]["mother"] in zero_gene:
-                    p1= 0.99
-                if people[person]["mother"] in one_gene:
-                    p1=0.5
-                if people[person]["mother"] in two_genes:
-                    p1=0.01
-                #calculating the prob for gene for father:
-                if people[person]["father"] in zero_gene:
-                    p2=0.99
-                if people[person]["father"] in one_gene:
-                    p2=0.5
-                if people[person]["father"] in two_genes:
-                    p2=0.01
-                if person in have_trait:
-                    calculation=(p1*p2)*PROBS["trait"][0][True]*calculation
-                else:
-                    calculation=(p1*p2)*PROBS["trait"][0][False]*calculation
-        
-            
-        
-        
-        
-            
-                    
-                
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    #making a new set for all the people that have no parents:
-
-    no_Parents=set()
-    mother_cal=1.0
-    father_cal=1.0
-    return calculation
-    ''' for person in people:
-        if person[1] is None and person[2] is None:
-            no_Parents.add(person)
-    for person in no_Parents:
-        mother_cal=1.0
-        father_cal=1.0
-        if person in one_gene:
-            print("got in to one_gene")
-            #checking if it came from mom:
-            mother_cal*= 0.5*0.99*0.01
-            mother_cal*=0.01*0.99*0.5
-            #if came from father and not from mom:
-            father_cal*= mother_cal
-            if person in have_trait():
-                calculation*=(mother_cal+father_cal)*PROBS["trait"][1][True]
-            else:
-                calculation*=(mother_cal+father_cal)*PROBS["trait"][1][False]
-        if person in two_genes:
-            print("got in to two")
-        
-        
-               #checjing if the gene came from mother:
-            mother_cal*=0.5*0.99*0.01
-            # and if it cma eform father
-            father_cal*= 0.99*0.5*0.1
-            if person in have_trait():
-                print("got in to have trait")
-                calculation*=(mother_cal+father_cal)*PROBS["trait"][1][True]
-            else:
-                calculation*=(mother_cal+father_cal)*PROBS["trait"][1][False]
-        if person in have_trait:
-            if person in zero_gene:
-                calculation*= PROBS["trait"][0][True]
-            if person in one_gene:
-                calculation*= PROBS["trait"][1][True]
-            if person in two_genes:
-                calculation*= PROBS["trait"][2][True]
-                
-        '''
-        
-        
-        #triying it one more time:
-''' 
-        for person in people:
-            counter=0
-            if person in one_gene:
-                if person[1] is not None  and person[2] is not None and person[3]==0:
-                    calculation=PROBS["gene"][1] * PROBS["trait"][1][False]*calculation
-                    counter=counter+1
-                if person[1] is not None  and person[2] is not None and person[3]==1:
-                    calculation=PROBS["gene"][1] * PROBS["trait"][1][True]*calculation
-                    counter=counter+1
-                if counter>0:
-                     #checking if it came from mom:
-                    p1=0.5
-                    p2=0.5
-                    #if came from father and not from mom:
-                    p3=0.5
-                    p4=0.5
-                    if person in have_trait():
-                        calculation*=(p1*p2+p3*p4)*PROBS["trait"][1][True]
-                    else:
-                        calculation*=(p1*p2+p3*p4)*PROBS["trait"][1][False]
-                if person in two_genes:
-                    #if one from mom amd one from the dad:
-                    if person[1] is not None  and person[2] is not None and person[3]==0:
-                        calculation=PROBS["gene"][2] * PROBS["trait"][2][False]*calculation
-                        counter=counter+1
-                    if person[1] is not None  and person[2] is not None and person[3]==1:
-                        calculation=PROBS["gene"][2] * PROBS["trait"][2][True]*calculation
-                        counter=counter+1
-                    if counter>0:
-                        
-                    '''
-                    
-                
-            
-''' 
-    if person not in have_trait and person not in one_gene and person not in two_genes:
-            print("got in to if of everything none!!")
-            #calculate the prob he doesnt have a trait!!
-            if person in zero_gene:
-                calculation*= PROBS["trait"][0][False]
-            if person in one_gene:
-                calculation*= PROBS["trait"][1][False]
-            if person in two_genes:
-                calculation*= PROBS["trait"][2][False]
-    '''        
-    # print (calculation)       
-    # return calculation
-
-            
-        
-            
-        
-    
-        
-            
-    
-    #raise NotImplementedError
+        genes = gene_count(person, one_gene, two_genes)
+        probability *= gene_term(
+            person, parents(people, person), one_gene, two_genes,
+            model.prior, model.inherit
+        )
+        probability *= model.emit[genes][person in have_trait]
+    return probability
+
+
+def gene_term(person, family, one_gene, two_genes, prior, inherit):
+    """
+    Return the entry of `prior` (for founders) or `inherit` (for children)
+    for `person`'s gene count in the assignment, where `family` is their
+    (mother, father) or None. Passing the log tables of a `Model` gives
+    the log of the probability instead.
+    """
+    genes = gene_count(person, one_gene, two_genes)
+    if family is None:
+        return prior[genes]
+    mother, father = family
+    return inherit[genes][
+        gene_count(mother, one_gene, two_genes)
+    ][gene_count(father, one_gene, two_genes)]
+
+
+def lineage(people):
+    """
+    Return a (person, parents, trait) tuple for each person, with
+    `parents` as returned by `parents`, so that code evaluating many
+    assignments looks them up once per family rather than per assignment.
+    """
+    return [(person, parents(people, person), people[person]["trait"])
+            for person in people]
+
+
+def evidence_probability(people, one_gene, two_genes, model=None,
+                         plan=None):
+    """
+    Return the probability of a gene assignment together with the traits
+    that were observed. Each unobserved trait is summed out analytically:
+    its two outcomes add up to 1, so only observed traits contribute.
+    `plan` is `lineage(people)`, computed here if not given.
+    """
+    if model is None:
+        model = Model()
+    if plan is None:
+        plan = lineage(people)
+    probability = 1
+    for person, family, trait in plan:
+        genes = gene_count(person, one_gene, two_genes)
+        probability *= gene_term(
+            person, family, one_gene, two_genes, model.prior, model.inherit
+        )
+        if trait is not None:
+            probability *= model.emit[genes][trait]
+    return probability
+
+
+def log_evidence_probability(people, one_gene, two_genes, model=None,
+                             plan=None):
+    """
+    Return the natural logarithm of `evidence_probability`.
+    """
+    if model is None:
+        model = Model()
+    if plan is None:
+        plan = lineage(people)
+    log_p = 0
+    for person, family, trait in plan:
+        genes = gene_count(person, one_gene, two_genes)
+        log_p += gene_term(
+            person, family, one_gene, two_genes,
+            model.log_prior, model.log_inherit
+        )
+        if trait is not None:
+            log_p += model.log_emit[genes][trait]
+    return log_p
 
 
 def update(probabilities, one_gene, two_genes, have_trait, p):
@@ -637,39 +996,1512 @@ def update(probabilities, one_gene, two_genes, have_trait, p):
     the person is in `have_gene` and `have_trait`, respectively.
     """
     for person in probabilities:
-        if person in one_gene:
-            probabilities[person]["gene"][1] += p
-        if person in two_genes:
-            probabilities[person]["gene"][2] += p
-        if person in have_trait:
-            probabilities[person]["trait"][True] += p
-        else:
-            probabilities[person]["trait"][False] += p
-   
-    #raise NotImplementedError
+        genes = gene_count(person, one_gene, two_genes)
+        probabilities[person]["gene"][genes] += p
+        probabilities[person]["trait"][person in have_trait] += p
+
+
+def known_traits(people):
+    """
+    Return the set of people observed to have the trait.
+    """
+    return {person for person in people if people[person]["trait"]}
+
+
+def fill_traits(probabilities, people, model):
+    """
+    Set every person's trait distribution from normalized gene
+    probabilities: observed traits are certain, and unobserved ones are
+    the gene distribution weighted by the chance of the trait.
+    """
+    pedigree = as_pedigree(people)
+    for i, person in enumerate(pedigree.names):
+        probabilities[person]["trait"].update(trait_distribution(
+            probabilities[person]["gene"], pedigree.trait(i), model
+        ))
+
+
+def trait_distribution(gene, trait, model):
+    """
+    Return the trait distribution of someone with normalized gene
+    distribution `gene` and observed `trait` (None if unobserved).
+    """
+    if trait is None:
+        p = sum(gene[genes] * model.emit[genes][True] for genes in GENES)
+    else:
+        p = 1 if trait else 0
+    return {True: p, False: 1 - p}
+
+
+def log_update(probabilities, one_gene, two_genes, have_trait, log_p):
+    """
+    Like `update`, but `probabilities` and `log_p` hold natural logarithms
+    and are combined with log-sum-exp.
+    """
+    for person in probabilities:
+        genes = gene_count(person, one_gene, two_genes)
+        gene = probabilities[person]["gene"]
+        gene[genes] = log_sum(gene[genes], log_p)
+        trait = probabilities[person]["trait"]
+        has_trait = person in have_trait
+        trait[has_trait] = log_sum(trait[has_trait], log_p)
 
 
 def normalize(probabilities):
     """
     Update `probabilities` such that each probability distribution
     is normalized (i.e., sums to 1, with relative proportions the same).
+    Totals accumulated by `update` are plain sums; the enumerate-log
+    engine accumulates in log space for families where they underflow.
+    """
+    for person in probabilities:
+        for field, distribution in probabilities[person].items():
+            total = sum(distribution.values())
+            if total == 0:
+                raise ValueError(
+                    f"{field} probabilities of {person} are all 0"
+                )
+            for value in distribution:
+                distribution[value] /= total
+
+
+def log_normalize(probabilities):
+    """
+    Replace log-space `probabilities` by normalized probabilities.
+    """
+    for person in probabilities:
+        for field, distribution in probabilities[person].items():
+            peak = max(distribution.values())
+            if peak == -math.inf:
+                raise ValueError(
+                    f"{field} probabilities of {person} are all 0"
+                )
+            total = peak + math.log(math.fsum(
+                math.exp(log_p - peak) for log_p in distribution.values()
+            ))
+            for value in distribution:
+                distribution[value] = math.exp(distribution[value] - total)
+
+
+def enumerate_probabilities(people, model=None, stats=None, compress=True):
+    """
+    Compute normalized probabilities by summing over every gene assignment.
+    Unobserved traits are summed out analytically rather than enumerated,
+    and so are groups of exchangeable siblings if `compress` is set.
+    Exponential in family size; kept as the reference the other engines
+    are checked against.
+    """
+    people = as_people(people)
+    if model is None:
+        model = Model()
+    if stats is None:
+        stats = NO_STATS
+    probabilities = empty_probabilities(people)
+
+    # Add up the probability of every gene assignment
+    accumulate(probabilities, people, model, stats, compress=compress)
+
+    # Ensure probabilities sum to 1
+    with stats.phase("normalize"):
+        normalize(probabilities)
+        fill_traits(probabilities, people, model)
+    return probabilities
+
+
+def sibships(people):
+    """
+    Return the groups of exchangeable siblings in `people` as (members,
+    parents, trait) tuples: two or more people with the same parents and
+    the same observed trait, none of whom has children. Given their
+    parents, the genes of a group's members are independent and
+    identically distributed.
+    """
+    has_children = {parent for person in people
+                    for parent in parents(people, person) or ()}
+    groups = {}
+    for person in people:
+        family = parents(people, person)
+        if family is not None and person not in has_children:
+            key = (family, people[person]["trait"])
+            groups.setdefault(key, []).append(person)
+    return [(members, family, trait)
+            for (family, trait), members in groups.items()
+            if len(members) > 1]
+
+
+def sibling_weights(family, trait, one_gene, two_genes, model):
+    """
+    Return the probability of each gene count of a child of `family`
+    together with the child's observed `trait` (None if unknown), given
+    the parents' genes in the assignment.
+    """
+    mother, father = family
+    inherit = [row[gene_count(mother, one_gene, two_genes)]
+               [gene_count(father, one_gene, two_genes)]
+               for row in model.inherit]
+    if trait is None:
+        return inherit
+    return [p * model.emit[genes][trait] for genes, p in zip(GENES, inherit)]
+
+
+def accumulate(probabilities, people, model, stats, prefix=(),
+               log_space=False, compress=True):
+    """
+    Add to `probabilities` the probability of each gene assignment in the
+    shard selected by `prefix`, or its logarithm if `log_space` is set.
+    Assignments the evidence rules out are skipped.
+
+    If `compress` is set, the siblings in each group found by `sibships`
+    are not enumerated. For each assignment of everyone else, a group of
+    k siblings contributes the sum of `sibling_weights` raised to the
+    power k, and each member's gene counts get their share of it. Shards
+    then fix the gene counts of the first people who are enumerated.
+
+    Counts and the time spent enumerating and updating are recorded in
+    `stats`, and each assignment is traced if it has a sink. Disabled
+    `stats` cost two branches per assignment.
+    """
+    if log_space:
+        evaluate, add, zero = log_evidence_probability, log_update, -math.inf
+    else:
+        evaluate, add, zero = evidence_probability, update, 0
+    groups = sibships(people) if compress else []
+    grouped = {person for members, _, _ in groups for person in members}
+    names = [person for person in people if person not in grouped]
+    enumerated = {person: probabilities[person] for person in names}
+    have_trait = known_traits(people)
+    plan = [entry for entry in lineage(people) if entry[0] not in grouped]
+
+    timed = stats.enabled
+    tracing = stats.sink is not None
+    clock = time.perf_counter
+    generated = pruned = 0
+    updating = 0
+    start = clock()
+    for one_gene, two_genes in gene_assignments(names, prefix):
+        generated += 1
+        p = evaluate(people, one_gene, two_genes, model, plan)
+        shares = []
+        for members, family, trait in groups:
+            weights = sibling_weights(family, trait, one_gene, two_genes,
+                                      model)
+            total = math.fsum(weights)
+            if total == 0:
+                p = zero
+                break
+            shares.append([weight / total for weight in weights])
+            if log_space:
+                p += len(members) * math.log(total)
+            else:
+                p *= total ** len(members)
+        if p == zero:
+            pruned += 1
+            continue
+        if timed:
+            begin = clock()
+        add(enumerated, one_gene, two_genes, have_trait, p)
+        for (members, _, trait), share in zip(groups, shares):
+            add_siblings(probabilities, members, trait, share, p, log_space)
+        if timed:
+            updating += clock() - begin
+        if tracing:
+            stats.trace(
+                "assignment", one_gene=sorted(one_gene),
+                two_genes=sorted(two_genes), p=p
+            )
+    stats.time("enumerate", clock() - start - updating)
+    stats.time("update", updating)
+    stats.count("generated", generated)
+    stats.count("pruned", pruned)
+    stats.count("evaluated", generated - pruned)
+
+
+def add_siblings(probabilities, members, trait, share, p, log_space=False):
+    """
+    Add probability `p` of an assignment to each of a group of exchangeable
+    siblings, split over their gene counts in proportion to `share`.
+    """
+    for person in members:
+        gene = probabilities[person]["gene"]
+        traits = probabilities[person]["trait"]
+        if log_space:
+            for genes in GENES:
+                gene[genes] = log_sum(gene[genes], p + log(share[genes]))
+            traits[bool(trait)] = log_sum(traits[bool(trait)], p)
+        else:
+            for genes in GENES:
+                gene[genes] += p * share[genes]
+            traits[bool(trait)] += p
+
+
+def merge(probabilities, partial):
+    """
+    Add the unnormalized `partial` probabilities into `probabilities`.
     """
     for person in probabilities:
-        
-        #finding the factor to multiply for looking at the trait
-        prob_sum= probabilities[person]["trait"][False]+probabilities[person]["trait"][True]
-        factor= 1/prob_sum
-        probabilities[person]["trait"][False]*=factor
-        probabilities[person]["trait"][True]*=factor
-        # ORI SEE WHAT I CHANGED ABOVE and implement below
-        #finding the factor to multiply for looking at the geens
-        prob_sum= probabilities[person]["gene"][1]+probabilities[person]["gene"][2]+probabilities[person]["gene"][0]
-        factor= 1/prob_sum
-        probabilities[person]["gene"][0]*=factor
-        probabilities[person]["gene"][1]*=factor
-        probabilities[person]["gene"][2]*=factor
-        
-    #raise NotImplementedError
+        for field, distribution in partial[person].items():
+            for value, p in distribution.items():
+                probabilities[person][field][value] += p
+
+
+def enumerate_shard(people, model, prefix, instrument=False, compress=True):
+    """
+    Return (probabilities, stats) where `probabilities` are unnormalized
+    and summed over the gene assignments in the shard selected by
+    `prefix`, and `stats` holds the shard's counters if `instrument` is
+    set.
+    """
+    stats = Stats() if instrument else NO_STATS
+    probabilities = empty_probabilities(people)
+    accumulate(probabilities, people, model, stats, prefix,
+               compress=compress)
+    return probabilities, stats
+
+
+def parallel_probabilities(people, model=None, workers=None,
+                           chunk_size=CHUNK_SIZE, stats=None, compress=True):
+    """
+    Compute normalized probabilities like `enumerate_probabilities`, with
+    the gene assignments split into shards of about `chunk_size` and spread
+    over `workers` processes (one per CPU by default). Each shard is summed
+    on its own and the partial sums are merged before normalizing.
+    Counters and timers from the shards are merged into `stats`, but
+    assignments are not traced since the sink stays in this process.
+    """
+    people = as_people(people)
+    if model is None:
+        model = Model()
+    if stats is None:
+        stats = NO_STATS
+
+    # Fix enough leading people's gene counts that each shard is small
+    count = len(people)
+    if compress:
+        count -= sum(len(members) for members, _, _ in sibships(people))
+    depth = count
+    while depth > 0 and 3 ** (count - depth + 1) <= chunk_size:
+        depth -= 1
+    prefixes = list(itertools.product(GENES, repeat=depth))
+
+    probabilities = empty_probabilities(people)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        partials = pool.map(
+            enumerate_shard,
+            itertools.repeat(people),
+            itertools.repeat(model),
+            prefixes,
+            itertools.repeat(stats.enabled),
+            itertools.repeat(compress)
+        )
+        for partial, shard_stats in partials:
+            merge(probabilities, partial)
+            stats.merge(shard_stats)
+
+    # Ensure probabilities sum to 1
+    with stats.phase("normalize"):
+        normalize(probabilities)
+        fill_traits(probabilities, people, model)
+    return probabilities
+
+
+def log_enumerate_probabilities(people, model=None, stats=None,
+                                compress=True):
+    """
+    Compute normalized probabilities like `enumerate_probabilities`, but
+    accumulate in log space so large families neither underflow nor lose
+    precision to rounding.
+    """
+    people = as_people(people)
+    if model is None:
+        model = Model()
+    if stats is None:
+        stats = NO_STATS
+    probabilities = empty_probabilities(people, -math.inf)
+    accumulate(probabilities, people, model, stats, log_space=True,
+               compress=compress)
+    with stats.phase("normalize"):
+        log_normalize(probabilities)
+        fill_traits(probabilities, people, model)
+    return probabilities
+
+
+def search_probabilities(people, model=None, epsilon=0, stats=None):
+    """
+    Compute normalized probabilities by a depth-first search over gene
+    assignments. People are assigned one at a time in topological order,
+    each branch multiplying the product of the people above it by one
+    person's factor, so assignments sharing a prefix share its product.
+    The probability of each subtree is added to the marginal of the
+    person assigned at its root, rather than to everyone at every leaf.
+
+    Every factor is at most 1, so a branch's product bounds every
+    assignment under it. A branch is pruned with everything under it if
+    its product is 0, or below `epsilon` times the most likely complete
+    assignment found so far. Branches are tried most likely first, so
+    that assignment is found early. With the default `epsilon` of 0 the
+    result is exact; a larger one trades the mass of the pruned branches
+    for time. The number of pruned branches is counted in `stats` as
+    "pruned".
+    """
+    pedigree = as_pedigree(people)
+    if model is None:
+        model = Model()
+    if stats is None:
+        stats = NO_STATS
+    probabilities = empty_probabilities(pedigree.names)
+    gene = [probabilities[name]["gene"] for name in pedigree.names]
+    trait = [probabilities[name]["trait"] for name in pedigree.names]
+    genes = [0] * len(pedigree)
+    counts = {"nodes": 0, "pruned": 0, "evaluated": 0}
+
+    # Product below which branches are pruned
+    threshold = [0]
+
+    # Each person's factor for each gene count, given their parents'
+    plan = []
+    for i in pedigree.order:
+        code = pedigree.traits[i]
+        emit = [1 if code < 0 else model.emit[g][bool(code)] for g in GENES]
+        if pedigree.mothers[i] < 0:
+            terms = [model.prior[g] * emit[g] for g in GENES]
+        else:
+            terms = [[[model.inherit[g][m][f] * emit[g] for g in GENES]
+                      for f in GENES] for m in GENES]
+        plan.append((i, pedigree.mothers[i], pedigree.fathers[i],
+                     code > 0, terms))
+
+    def search(depth, p):
+        """
+        Return the total probability of the assignments extending the
+        current one, whose product so far is `p`, from person `depth` on.
+        """
+        if depth == len(plan):
+            counts["evaluated"] += 1
+            threshold[0] = max(threshold[0], p * epsilon)
+            return p
+        i, mother, father, has_trait, terms = plan[depth]
+        if mother >= 0:
+            terms = terms[genes[mother]][genes[father]]
+        total = 0
+        for g in sorted(GENES, key=terms.__getitem__, reverse=True):
+            counts["nodes"] += 1
+            branch = p * terms[g]
+            if branch == 0 or branch < threshold[0]:
+                counts["pruned"] += 1
+                continue
+            genes[i] = g
+            subtotal = search(depth + 1, branch)
+            gene[i][g] += subtotal
+            total += subtotal
+        trait[i][has_trait] += total
+        return total
+
+    with stats.phase("search"):
+        total = search(0, 1)
+    for name, count in counts.items():
+        stats.count(name, count)
+    if total == 0:
+        raise PedigreeError(["the observed traits are impossible under the "
+                             "model"])
+
+    # Ensure probabilities sum to 1
+    with stats.phase("normalize"):
+        normalize(probabilities)
+        fill_traits(probabilities, pedigree, model)
+    return probabilities
+
+
+def require_numpy():
+    """
+    Raise an error naming the missing dependency if NumPy is not installed.
+    """
+    if np is None:
+        raise RuntimeError("this feature requires numpy (pip install numpy)")
+
+
+def parent_indices(people):
+    """
+    Return (names, mothers, fathers) where `mothers` and `fathers` hold the
+    position in `names` of each person's parents, or -1 for founders.
+    """
+    require_numpy()
+    pedigree = as_pedigree(people)
+    return (
+        pedigree.names,
+        np.frombuffer(pedigree.mothers, dtype=np.int64),
+        np.frombuffer(pedigree.fathers, dtype=np.int64)
+    )
+
+
+def joint_probabilities(genes, traits, mothers, fathers, model=None,
+                        observed=None):
+    """
+    Compute `joint_probability` for a whole batch of assignments at once.
+    `genes` is an integer array of gene counts and `traits` a boolean array,
+    both shaped (assignments, people) with columns ordered as the parent
+    index arrays `mothers` and `fathers` (-1 for founders). `traits` may
+    also be a single row shared by every assignment.
+    If given, `observed` is a boolean array per person; traits of people
+    not observed are summed out as in `evidence_probability`.
+    Return an array of one joint probability per assignment.
+    """
+    if model is None:
+        model = Model()
+    prior, inherit, emit = model.arrays()
+    genes = np.asarray(genes)
+    traits = np.asarray(traits, dtype=bool)
+
+    founders = np.flatnonzero(mothers < 0)
+    children = np.flatnonzero(mothers >= 0)
+    p = prior[genes[:, founders]].prod(axis=1)
+    p *= inherit[
+        genes[:, children],
+        genes[:, mothers[children]],
+        genes[:, fathers[children]]
+    ].prod(axis=1)
+    emission = emit[genes, traits.astype(np.intp)]
+    if observed is not None:
+        emission = np.where(observed, emission, 1)
+    p *= emission.prod(axis=1)
+    return p
+
+
+def gene_batches(count, chunk_size=CHUNK_SIZE):
+    """
+    Yield integer arrays covering every gene assignment of `count` people,
+    shaped (assignments, people) with at most `chunk_size` rows each.
+    """
+    require_numpy()
+    radix = 3 ** np.arange(count, dtype=np.int64)
+    total = 3 ** count
+    for start in range(0, total, chunk_size):
+        stop = min(start + chunk_size, total)
+        index = np.arange(start, stop, dtype=np.int64)
+        yield (index[:, None] // radix) % 3
+
+
+class Accumulator:
+    """
+    Dense running totals of unnormalized gene probabilities, with a row
+    per person and a column per gene count, added to a batch of encoded
+    assignments at a time instead of one `update` per assignment.
+    """
+
+    __slots__ = ("gene",)
+
+    def __init__(self, count):
+        require_numpy()
+        self.gene = np.zeros((count, len(GENES)))
+
+    def add(self, genes, p):
+        """
+        Add probabilities `p` of the assignments in `genes`, an integer
+        array shaped (assignments, people). Each gene count's indicator
+        matrix turns the per-person sums into one matrix product.
+        """
+        for value in GENES:
+            self.gene[:, value] += p @ (genes == value)
+
+    def probabilities(self, names, have_trait):
+        """
+        Return the totals in the nested `probabilities` shape, ready for
+        `normalize`. Each person's trait total goes to the value in the
+        boolean array `have_trait`, as `update` would add it.
+        """
+        probabilities = empty_probabilities(names)
+        for person, row, trait in zip(names, self.gene.tolist(), have_trait):
+            probabilities[person]["gene"].update(zip(GENES, row))
+            probabilities[person]["trait"][bool(trait)] = math.fsum(row)
+        return probabilities
+
+
+def batch_probabilities(people, model=None, chunk_size=CHUNK_SIZE,
+                        stats=None):
+    """
+    Compute normalized probabilities by enumerating every gene assignment
+    like `enumerate_probabilities`, but in NumPy chunks of `chunk_size`
+    assignments. Counters and timers are recorded per chunk in `stats`.
+    """
+    if model is None:
+        model = Model()
+    if stats is None:
+        stats = NO_STATS
+    pedigree = as_pedigree(people)
+    names, mothers, fathers = parent_indices(pedigree)
+    codes = np.frombuffer(pedigree.traits, dtype=np.int8)
+    totals = Accumulator(len(names))
+    for genes in gene_batches(len(names), chunk_size):
+        with stats.phase("enumerate"):
+            p = joint_probabilities(
+                genes, codes == 1, mothers, fathers, model,
+                observed=codes >= 0
+            )
+        if stats.enabled:
+            pruned = len(p) - int(np.count_nonzero(p))
+            stats.count("generated", len(p))
+            stats.count("pruned", pruned)
+            stats.count("evaluated", len(p) - pruned)
+        with stats.phase("update"):
+            totals.add(genes, p)
+
+    # Ensure probabilities sum to 1
+    with stats.phase("normalize"):
+        probabilities = totals.probabilities(names, codes == 1)
+        normalize(probabilities)
+        fill_traits(probabilities, pedigree, model)
+    return probabilities
+
+
+def gibbs_sample(people, model=None, chains=CHAINS, sweeps=SWEEPS,
+                 burn_in=BURN_IN, seconds=None, seed=None):
+    """
+    Estimate probabilities by Gibbs sampling `chains` independent chains at
+    once, each resampling every person's gene from its distribution given
+    everyone else. Stop after `sweeps` sweeps over the family per chain, or
+    once `seconds` have passed, whichever comes first. Sweeps are discarded
+    as burn-in until the fraction `burn_in` of either limit is used up,
+    but at least two are kept, so a short deadline still gives an
+    estimate. `seed` makes the run reproducible.
+
+    Return a dictionary with the estimated "probabilities", their standard
+    "errors" and the Gelman-Rubin "rhat" of each value (close to 1 once the
+    chains agree), all shaped like `probabilities`, plus the number of
+    "sweeps" kept per chain. Errors and R-hat compare chains, so they are
+    NaN when there is only one.
+    """
+    require_numpy()
+    if sweeps < 2:
+        raise ValueError("at least 2 sweeps are needed to estimate errors")
+    if model is None:
+        model = Model()
+    pedigree = as_pedigree(people)
+    count = len(pedigree)
+    mothers = np.frombuffer(pedigree.mothers, dtype=np.int64)
+    fathers = np.frombuffer(pedigree.fathers, dtype=np.int64)
+    codes = np.frombuffer(pedigree.traits, dtype=np.int8)
+    prior, inherit, emit = model.arrays()
+    with np.errstate(divide="ignore"):
+        log_prior, log_inherit, log_emit = (
+            np.log(prior), np.log(inherit), np.log(emit)
+        )
+    rng = np.random.default_rng(seed)
+    genes = np.arange(3)
+
+    # Children of each person as mother and as father
+    as_mother = [np.array([c for c in children if mothers[c] == i],
+                          dtype=np.int64)
+                 for i, children in enumerate(pedigree.children)]
+    as_father = [np.array([c for c in children if fathers[c] == i],
+                          dtype=np.int64)
+                 for i, children in enumerate(pedigree.children)]
+
+    def draw(p):
+        return (rng.random((chains, 1)) > p.cumsum(axis=1)).sum(axis=1)
+
+    # Start every chain from a forward simulation of the model
+    state = np.zeros((chains, count), dtype=np.intp)
+    for i in pedigree.order:
+        if mothers[i] < 0:
+            p = np.broadcast_to(prior, (chains, 3))
+        else:
+            p = inherit[:, state[:, mothers[i]], state[:, fathers[i]]].T
+        state[:, i] = np.minimum(draw(p), 2)
+
+    # Running sums of each sweep's conditional gene and trait distributions
+    trait = emit[:, 1]
+    total = np.zeros((chains, count, 3))
+    squares = np.zeros((chains, count, 3))
+    trait_total = np.zeros((chains, count))
+    trait_squares = np.zeros((chains, count))
+    kept = 0
+    burning = min(int(burn_in * sweeps), sweeps - 2)
+    start = time.perf_counter()
+    for sweep in range(sweeps):
+        if seconds is not None:
+            elapsed = time.perf_counter() - start
+            if elapsed > seconds and kept >= 2:
+                break
+            if elapsed >= burn_in * seconds:
+                burning = min(burning, sweep)
+        keep = sweep >= burning
+        for i in range(count):
+            if mothers[i] < 0:
+                log_p = np.broadcast_to(log_prior, (chains, 3)).copy()
+            else:
+                log_p = log_inherit[
+                    :, state[:, mothers[i]], state[:, fathers[i]]
+                ].T.copy()
+            if codes[i] >= 0:
+                log_p += log_emit[:, codes[i]]
+            children = as_mother[i]
+            if len(children):
+                log_p += log_inherit[
+                    state[:, children][:, :, None],
+                    genes,
+                    state[:, fathers[children]][:, :, None]
+                ].sum(axis=1)
+            children = as_father[i]
+            if len(children):
+                log_p += log_inherit[
+                    state[:, children][:, :, None],
+                    state[:, mothers[children]][:, :, None],
+                    genes
+                ].sum(axis=1)
+            p = np.exp(log_p - log_p.max(axis=1, keepdims=True))
+            p /= p.sum(axis=1, keepdims=True)
+            state[:, i] = np.minimum(draw(p), 2)
+            if keep:
+                total[:, i] += p
+                squares[:, i] += p * p
+                t = p @ trait
+                trait_total[:, i] += t
+                trait_squares[:, i] += t * t
+        if keep:
+            kept += 1
+
+    # Observed traits are certain
+    observed = codes >= 0
+    means = total / kept
+    within = (squares / kept - means ** 2) * kept / (kept - 1)
+    trait_means = trait_total / kept
+    trait_within = ((trait_squares / kept - trait_means ** 2)
+                    * kept / (kept - 1))
+    trait_means = np.where(observed, codes == 1, trait_means)
+    trait_within = np.where(observed, 0, trait_within)
+
+    def summarize(chain_means, chain_within):
+        estimate = chain_means.mean(axis=0)
+        if chains > 1:
+            between = chain_means.var(axis=0, ddof=1)
+        else:
+            between = np.full_like(estimate, np.nan)
+        error = np.sqrt(between / chains)
+        w = chain_within.mean(axis=0)
+        pooled = (kept - 1) / kept * w + between
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rhat = np.where(w > 0, np.sqrt(pooled / w), 1)
+        if chains == 1:
+            rhat = np.full_like(estimate, np.nan)
+        return estimate, error, rhat
+
+    gene_stats = summarize(means, within)
+    trait_stats = summarize(trait_means, trait_within)
+    results = {"sweeps": kept}
+    for key, (gene, traits) in zip(
+        ("probabilities", "errors", "rhat"), zip(gene_stats, trait_stats)
+    ):
+        results[key] = {
+            name: {
+                "gene": {g: float(gene[i, g]) for g in (2, 1, 0)},
+                "trait": (
+                    {True: float(traits[i]), False: 1 - float(traits[i])}
+                    if key == "probabilities" else
+                    {True: float(traits[i]), False: float(traits[i])}
+                )
+            }
+            for i, name in enumerate(pedigree.names)
+        }
+    return results
+
+
+def gibbs_probabilities(people, model=None, chains=CHAINS, sweeps=SWEEPS,
+                        burn_in=BURN_IN, seconds=None, seed=None, stats=None):
+    """
+    Estimate normalized probabilities with `gibbs_sample`, for families too
+    large for exact inference. The time taken and the number of sweeps run
+    are recorded in `stats`, along with the largest standard error and
+    R-hat of any value in any family sampled ("max_error" and "max_rhat",
+    None with a single chain). Every person's errors and R-hats are traced.
+    """
+    if stats is None:
+        stats = NO_STATS
+    with stats.phase("sample"):
+        result = gibbs_sample(people, model, chains=chains, sweeps=sweeps,
+                              burn_in=burn_in, seconds=seconds, seed=seed)
+    stats.count("sweeps", result["sweeps"])
+    for key in ("errors", "rhat"):
+        name = f"max_{key.rstrip('s')}"
+        values = [p for person in result[key].values()
+                  for distribution in person.values()
+                  for p in distribution.values()]
+        earlier = stats.values.get(name, 0)
+        values.append(math.nan if earlier is None else earlier)
+
+        # NaN, from a single chain, wins over any number
+        worst = max(values, key=lambda p: (math.isnan(p), p))
+        stats.note(name, finite(worst))
+    if stats.sink is not None:
+        stats.trace("diagnostics", **{
+            key: {name: {field: [finite(p) for p in distribution.values()]
+                         for field, distribution in person.items()}
+                  for name, person in result[key].items()}
+            for key in ("errors", "rhat")
+        })
+    return result["probabilities"]
+
+
+def finite(p):
+    """
+    Return `p`, or None if it is NaN, so it can be written as JSON.
+    """
+    return None if math.isnan(p) else p
+
+
+class Factor:
+    """
+    Non-negative function over the gene counts of the people in `scope`.
+    `table` maps each tuple of gene counts (ordered as `scope`) to a value.
+    """
+
+    __slots__ = ("scope", "table")
+
+    def __init__(self, scope, table):
+        self.scope = tuple(scope)
+        self.table = table
+
+    def __mul__(self, other):
+        scope = self.scope + tuple(v for v in other.scope
+                                   if v not in self.scope)
+        left = [scope.index(v) for v in self.scope]
+        right = [scope.index(v) for v in other.scope]
+        table = {}
+        for values in itertools.product(GENES, repeat=len(scope)):
+            table[values] = (
+                self.table[tuple(values[i] for i in left)] *
+                other.table[tuple(values[i] for i in right)]
+            )
+        return Factor(scope, table)
+
+    def normalized(self):
+        """
+        Return this factor scaled so that its values sum to 1.
+        """
+        total = sum(self.table.values())
+        return Factor(self.scope, {
+            values: p / total for values, p in self.table.items()
+        })
+
+    def project(self, scope):
+        """
+        Return a factor over `scope` with every other variable summed out.
+        """
+        scope = tuple(scope)
+        keep = [self.scope.index(v) for v in scope]
+        table = dict.fromkeys(itertools.product(GENES, repeat=len(scope)), 0)
+        for values, p in self.table.items():
+            table[tuple(values[i] for i in keep)] += p
+        return Factor(scope, table)
+
+
+def unit_factor(scope=()):
+    """
+    Return the factor over `scope` that leaves products unchanged.
+    """
+    return Factor(scope, dict.fromkeys(
+        itertools.product(GENES, repeat=len(scope)), 1
+    ))
+
+
+def emission(person, pedigree, model):
+    """
+    Return the likelihood of `person`'s observed trait for each gene count.
+    """
+    if isinstance(model, ModelStack) and model.traits is not None:
+        return model.emission(person)
+    trait = pedigree.trait(person)
+    if trait is None:
+        return {genes: 1 for genes in GENES}
+    return {genes: model.emit[genes][trait] for genes in GENES}
+
+
+def person_factor(person, pedigree, model):
+    """
+    Return the factor for `person`'s gene given their parents' genes,
+    weighted by the likelihood of their observed trait.
+    """
+    likelihood = emission(person, pedigree, model)
+    mother = pedigree.mothers[person]
+    father = pedigree.fathers[person]
+    if mother < 0:
+        return Factor((person,), {
+            (genes,): model.prior[genes] * likelihood[genes]
+            for genes in GENES
+        })
+    return Factor((person, mother, father), {
+        (genes, mother, father): (
+            model.inherit[genes][mother][father] * likelihood[genes]
+        )
+        for genes, mother, father in itertools.product(GENES, repeat=3)
+    })
+
+
+def has_loops(pedigree):
+    """
+    Return whether the graph joining each person to a node for each couple
+    they belong to, as a parent or as a child, contains a cycle, as it
+    does when relatives have children together.
+    """
+    leader = {}
+
+    def find(v):
+        leader.setdefault(v, v)
+        while leader[v] != v:
+            leader[v] = leader[leader[v]]
+            v = leader[v]
+        return v
+
+    def join(u, v):
+        a, b = find(u), find(v)
+        leader[a] = b
+        return a != b
+
+    couples = set()
+    for i in range(len(pedigree)):
+        mother, father = pedigree.mothers[i], pedigree.fathers[i]
+        if mother < 0:
+            continue
+        couple = ("couple", mother, father)
+        if couple not in couples:
+            couples.add(couple)
+            if not join(couple, mother) or not join(couple, father):
+                return True
+        if not join(couple, i):
+            return True
+    return False
+
+
+def elimination_heuristic(pedigree):
+    """
+    Return the `elimination_order` heuristic for `pedigree`. Without
+    loops, min-degree already eliminates without fill and costs time
+    linear in family size; min-fill is used only for families with loops,
+    where it usually finds smaller cliques.
+    """
+    return "min-fill" if has_loops(pedigree) else "min-degree"
+
+
+def elimination_order(factors, heuristic="min-degree"):
+    """
+    Return an order in which to sum out the variables of `factors`,
+    greedily picking the person whose elimination adds the fewest edges
+    between their neighbours ("min-fill") or who has the fewest neighbours
+    ("min-degree"). Ties go to the lowest person index. Min-fill costs
+    time cubic in the number of neighbours, so it is meant for families
+    with loops; see `elimination_heuristic`.
+    """
+    neighbours = {}
+    for factor in factors:
+        for v in factor.scope:
+            neighbours.setdefault(v, set()).update(factor.scope)
+            neighbours[v].discard(v)
+
+    def cost(v):
+        adjacent = neighbours[v]
+        if heuristic == "min-degree":
+            return len(adjacent)
+        return sum(len(adjacent - neighbours[u]) - 1 for u in adjacent) // 2
+
+    if heuristic not in ("min-fill", "min-degree"):
+        raise ValueError(f"unknown elimination heuristic {heuristic!r}")
+    costs = {v: cost(v) for v in neighbours}
+    heap = [(c, v) for v, c in costs.items()]
+    heapq.heapify(heap)
+    order = []
+    while heap:
+        c, v = heapq.heappop(heap)
+        if v not in neighbours or c != costs[v]:
+            continue
+        adjacent = neighbours.pop(v)
+        del costs[v]
+        order.append(v)
+
+        # Eliminating v connects all of its neighbours to each other, which
+        # changes the cost of them and, for min-fill, of their neighbours
+        for u in adjacent:
+            neighbours[u].discard(v)
+            neighbours[u].update(adjacent - {u})
+        changed = set(adjacent)
+        if heuristic == "min-fill":
+            for u in adjacent:
+                changed.update(neighbours[u])
+        for u in changed:
+            c = cost(u)
+            if c != costs[u]:
+                costs[u] = c
+                heapq.heappush(heap, (c, u))
+    return order
+
+
+def product(factors):
+    """
+    Return the product of an iterable of factors, up to a constant: the
+    running product is rescaled to sum to 1 after each factor, so that
+    multiplying many messages together does not underflow.
+    """
+    result = unit_factor()
+    for factor in factors:
+        result = (result * factor).normalized()
+    return result
+
+
+class Session:
+    """
+    Peeling of a pedigree that keeps its messages between queries.
+    People are summed out one at a time; eliminating a person forms a
+    clique from the factors that mention them and passes an "up" message
+    to the clique that absorbs it. "Down" messages sent back the other way
+    give every person's marginal, and are computed only when needed.
+
+    After `set_trait` or `clear_trait`, only the up messages from the
+    changed person's clique to the root of the tree are recomputed, and
+    down messages are refreshed lazily for the marginals asked for.
+    Messages, and the running products they are computed from, are
+    rescaled to sum to 1 so large families do not underflow.
+
+    The cliques form a junction tree, so families with loops are handled
+    exactly. People are eliminated in `order` if given, or in the order
+    chosen by `elimination_order` with `heuristic`, which defaults to
+    `elimination_heuristic`. `set_model` swaps in
+    new parameters without rebuilding the tree, and `save` stores the
+    compiled session for `load` to reuse in a later run.
+    """
+
+    def __init__(self, people, model=None, order=None, heuristic=None):
+        if model is None:
+            model = Model()
+        pedigree = as_pedigree(people)
+        self.pedigree = Pedigree(pedigree.names, pedigree.mothers,
+                                 pedigree.fathers, pedigree.traits,
+                                 pedigree.order, pedigree.children)
+        self.model = model
+        self.epoch = 0
+        factors = [person_factor(person, self.pedigree, model)
+                   for person in range(len(pedigree))]
+        if order is None:
+            order = elimination_order(
+                factors, heuristic or elimination_heuristic(self.pedigree)
+            )
+        self.order = list(order)
+        self.build(factors, self.order)
+        for clique in range(len(self.cliques)):
+            self.send_up(clique)
+
+    @property
+    def treewidth(self):
+        """
+        Return the width of the clique tree: one less than the number of
+        people in its largest clique. Peeling takes time exponential in it.
+        """
+        return max((len(clique["scope"]) for clique in self.cliques),
+                   default=1) - 1
+
+    def set_model(self, model):
+        """
+        Re-evaluate every message with the tables of `model`, keeping the
+        clique tree.
+        """
+        self.model = model
+        for index in range(len(self.cliques)):
+            self.cliques[index]["potential"] = None
+            self.send_up(index)
+        self.epoch += 1
+
+    def to_dict(self):
+        """
+        Return the pedigree, evidence, model and elimination order as a
+        JSON-compatible dictionary, from which `from_dict` rebuilds the
+        session without searching for an order again.
+        """
+        return {
+            "names": self.pedigree.names,
+            "mothers": list(self.pedigree.mothers),
+            "fathers": list(self.pedigree.fathers),
+            "traits": list(self.pedigree.traits),
+            "prior": self.model.prior,
+            "emit": self.model.emit,
+            "mutation": self.model.probs["mutation"],
+            "order": self.order
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Return the session described by a dictionary from `to_dict`.
+        """
+        probs = {
+            "gene": dict(zip(GENES, data["prior"])),
+            "trait": {
+                genes: {False: row[0], True: row[1]}
+                for genes, row in zip(GENES, data["emit"])
+            },
+            "mutation": data["mutation"]
+        }
+        pedigree = Pedigree(data["names"], data["mothers"], data["fathers"],
+                            data["traits"])
+        return cls(pedigree, Model(probs), order=data["order"])
+
+    def save(self, filename):
+        """
+        Write the session to `filename` as JSON.
+        """
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Return the session saved to `filename` by `save`.
+        """
+        with open(filename) as f:
+            return cls.from_dict(json.load(f))
+
+    def build(self, factors, order):
+        """
+        Eliminate people in `order`, recording for each clique the person
+        summed out, its scope, the people whose factors it absorbs, the
+        cliques whose messages it receives and the clique it sends to.
+        """
+        # Pending entries are (scope, person whose factor it is, or index
+        # of the clique whose message it is)
+        pending = {i: (factor.scope, i, None)
+                   for i, factor in enumerate(factors)}
+        holding = {person: set() for person in range(len(factors))}
+        for i, factor in enumerate(factors):
+            for v in factor.scope:
+                holding[v].add(i)
+
+        self.cliques = []
+        self.home = [None] * len(factors)
+        self.position = [None] * len(factors)
+        for person in order:
+            ids = holding.pop(person)
+            involved = [pending.pop(i) for i in sorted(ids)]
+            scope = []
+            for entry_scope, _, _ in involved:
+                scope.extend(v for v in entry_scope if v not in scope)
+            for v in scope:
+                if v != person:
+                    holding[v] -= ids
+
+            index = len(self.cliques)
+            clique = {
+                "person": person,
+                "scope": tuple(scope),
+                "factors": [owner for _, owner, child in involved
+                            if child is None],
+                "children": [child for _, _, child in involved
+                             if child is not None],
+                "parent": None,
+                "potential": None,
+                "up": None,
+                "down": None,
+                "epoch": -1
+            }
+            for owner in clique["factors"]:
+                self.home[owner] = index
+            for child in clique["children"]:
+                self.cliques[child]["parent"] = index
+            self.position[person] = index
+            self.cliques.append(clique)
+
+            # Hand the message on to whoever is eliminated next from it
+            message = tuple(v for v in scope if v != person)
+            key = len(factors) + index
+            pending[key] = (message, None, index)
+            for v in message:
+                holding[v].add(key)
+
+    def potential(self, index):
+        """
+        Return the product of the person factors absorbed by a clique.
+        """
+        clique = self.cliques[index]
+        if clique["potential"] is None:
+            clique["potential"] = product(
+                [unit_factor(clique["scope"])] +
+                [person_factor(owner, self.pedigree, self.model)
+                 for owner in clique["factors"]]
+            )
+        return clique["potential"]
+
+    def send_up(self, index):
+        """
+        Recompute the message a clique sends towards the root.
+        """
+        clique = self.cliques[index]
+        belief = product([self.potential(index)] + [
+            self.cliques[child]["up"] for child in clique["children"]
+        ])
+        clique["up"] = belief.project(
+            v for v in belief.scope if v != clique["person"]
+        ).normalized()
+
+    def down(self, index):
+        """
+        Return the message a clique receives from the rest of the tree,
+        first refreshing any out of date messages on the way from the root.
+        """
+        stale = []
+        clique = index
+        while clique is not None and (
+            self.cliques[clique]["epoch"] != self.epoch
+        ):
+            stale.append(clique)
+            clique = self.cliques[clique]["parent"]
+        for clique in reversed(stale):
+            self.send_down(clique)
+        return self.cliques[index]["down"]
+
+    def send_down(self, index):
+        """
+        Recompute the message a clique, and each of its siblings, receives
+        from its parent. The parent's own message must be up to date.
+        """
+        parent = self.cliques[index]["parent"]
+        if parent is None:
+            self.cliques[index]["down"] = unit_factor()
+            self.cliques[index]["epoch"] = self.epoch
+            return
+        children = self.cliques[parent]["children"]
+        ups = [self.cliques[child]["up"] for child in children]
+        base = self.potential(parent) * self.cliques[parent]["down"]
+
+        # Prefix and suffix products exclude one child at a time
+        prefix = [unit_factor()]
+        for up in ups:
+            prefix.append((prefix[-1] * up).normalized())
+        suffix = [unit_factor()]
+        for up in reversed(ups):
+            suffix.append((up * suffix[-1]).normalized())
+        suffix.reverse()
+        for i, child in enumerate(children):
+            others = base * prefix[i] * suffix[i + 1]
+            self.cliques[child]["down"] = (
+                others.project(ups[i].scope).normalized()
+            )
+            self.cliques[child]["epoch"] = self.epoch
+
+    def gene(self, person):
+        """
+        Return the normalized gene distribution of person index `person`.
+        """
+        index = self.position[person]
+        belief = product([self.potential(index), self.down(index)] + [
+            self.cliques[child]["up"]
+            for child in self.cliques[index]["children"]
+        ])
+        marginal = belief.project((person,))
+        total = sum(marginal.table.values())
+        return {genes: marginal.table[(genes,)] / total for genes in GENES}
+
+    def marginal(self, name):
+        """
+        Return the gene and trait distributions of the person called `name`.
+        """
+        person = self.pedigree.index[name]
+        gene = self.gene(person)
+        return {
+            "gene": gene,
+            "trait": trait_distribution(
+                gene, self.pedigree.trait(person), self.model
+            )
+        }
+
+    def probabilities(self):
+        """
+        Return normalized probabilities for everyone in the pedigree.
+        """
+        probabilities = empty_probabilities(self.pedigree.names)
+
+        # Visit the root first so each message is computed only once
+        for clique in reversed(self.cliques):
+            person = clique["person"]
+            name = self.pedigree.names[person]
+            probabilities[name]["gene"].update(self.gene(person))
+        fill_traits(probabilities, self.pedigree, self.model)
+        return probabilities
+
+    def set_trait(self, name, trait):
+        """
+        Record that the person called `name` has (True) or does not have
+        (False) the trait, or that it is unknown (None).
+        """
+        person = self.pedigree.index[name]
+        self.pedigree.traits[person] = encode_trait(trait)
+
+        # Only cliques between the changed factor and the root see it
+        index = self.home[person]
+        self.cliques[index]["potential"] = None
+        path = []
+        while index is not None:
+            self.send_up(index)
+            path.append(index)
+            index = self.cliques[index]["parent"]
+
+        # Down messages into that path do not depend on the change
+        self.epoch += 1
+        for index in path:
+            if self.cliques[index]["epoch"] == self.epoch - 1:
+                self.cliques[index]["epoch"] = self.epoch
+
+    def clear_trait(self, name):
+        """
+        Forget the observed trait of the person called `name`.
+        """
+        self.set_trait(name, None)
+
+
+def peel_probabilities(people, model=None, stats=None):
+    """
+    Compute normalized probabilities by peeling the pedigree with a
+    `Session`. Runs in time linear in family size for pedigrees without
+    loops, and in time exponential in the treewidth of looped ones. The
+    time spent peeling is recorded in `stats`, and the treewidth traced.
+    """
+    if stats is None:
+        stats = NO_STATS
+    with stats.phase("peel"):
+        session = Session(people, model)
+        stats.trace("compiled", people=len(session.pedigree),
+                    treewidth=session.treewidth)
+        return session.probabilities()
+
+
+def relevant_pedigree(people, targets, evidence=None):
+    """
+    Return the part of a family that the gene distributions of the people
+    named in `targets` depend on, as a `Pedigree` in the original order.
+    `evidence` maps names to observed traits (True, False or None for
+    unknown), replacing those in the family.
+
+    Only ancestors of the targets and of people with observed traits are
+    kept; everyone else is barren and sums out to 1. Of those, only people
+    linked to a target through parents and couples are kept, since genes
+    are never observed and any other part is d-separated from the targets.
+    """
+    pedigree = as_pedigree(people)
+    traits = array("b", pedigree.traits)
+    for name, trait in (evidence or {}).items():
+        traits[pedigree.index[name]] = encode_trait(trait)
+    targets = [pedigree.index[name] for name in targets]
+
+    # Ancestral closure of the targets and the evidence
+    keep = set()
+    stack = targets + [i for i in range(len(pedigree)) if traits[i] >= 0]
+    while stack:
+        i = stack.pop()
+        if i not in keep and i >= 0:
+            keep.add(i)
+            stack += [pedigree.mothers[i], pedigree.fathers[i]]
+
+    # Neighbours in the moral graph: parents, children and co-parents
+    neighbours = {i: set() for i in keep}
+    for i in keep:
+        mother, father = pedigree.mothers[i], pedigree.fathers[i]
+        if mother >= 0:
+            for a, b in ((i, mother), (i, father), (mother, father)):
+                neighbours[a].add(b)
+                neighbours[b].add(a)
+    connected = set()
+    stack = list(targets)
+    while stack:
+        i = stack.pop()
+        if i not in connected:
+            connected.add(i)
+            stack.extend(neighbours[i] - connected)
+
+    kept = sorted(connected)
+    position = {i: k for k, i in enumerate(kept)}
+    position[-1] = -1
+    return Pedigree(
+        [pedigree.names[i] for i in kept],
+        [position[pedigree.mothers[i]] for i in kept],
+        [position[pedigree.fathers[i]] for i in kept],
+        [traits[i] for i in kept]
+    )
+
+
+def query(people, targets, evidence=None, model=None):
+    """
+    Return normalized gene and trait probabilities for just the people
+    named in `targets`, given the family's traits updated with `evidence`
+    as in `relevant_pedigree`. Only the relevant part of the family is
+    peeled, and only the messages the targets need are passed down.
+    """
+    session = Session(relevant_pedigree(people, targets, evidence), model)
+    probabilities = empty_probabilities(targets)
+    for name in targets:
+        for field, distribution in session.marginal(name).items():
+            probabilities[name][field].update(distribution)
+    return probabilities
+
+
+def joint_query(people, targets, evidence=None, model=None):
+    """
+    Return the joint gene distribution of the people named in `targets`
+    as a dictionary from tuples of gene counts, ordered as `targets`, to
+    probabilities. Everyone else in the relevant part of the family is
+    summed out; the cost grows as 3 to the power of len(targets).
+    """
+    if model is None:
+        model = Model()
+    pedigree = relevant_pedigree(people, targets, evidence)
+    factors = [person_factor(person, pedigree, model)
+               for person in range(len(pedigree))]
+    scope = [pedigree.index[name] for name in targets]
+    for v in elimination_order(factors, elimination_heuristic(pedigree)):
+        if v in scope:
+            continue
+        involved = [factor for factor in factors if v in factor.scope]
+        factors = [factor for factor in factors if v not in factor.scope]
+        belief = product(involved)
+        factors.append(belief.project(
+            u for u in belief.scope if u != v
+        ).normalized())
+    joint = product(factors).project(scope).normalized()
+    return dict(joint.table)
+
+
+class ModelStack:
+    """
+    The tables of several `Model`s stacked along a parameter axis. Each
+    entry of `prior`, `inherit` and `emit` is indexed like a `Model`'s
+    but is a NumPy array holding that entry for every model, so code
+    written for one `Model` (such as a `Session`) computes the results
+    for all of them at once.
+
+    If given, `traits` is an array of trait codes shaped (models, people)
+    that replaces the pedigree's traits, so each model can stand for an
+    independent gene with its own evidence.
+    """
+
+    __slots__ = ("models", "prior", "inherit", "emit", "traits")
+
+    def __init__(self, models, traits=None):
+        require_numpy()
+        self.traits = None if traits is None else np.asarray(traits)
+        self.models = [model if isinstance(model, Model) else Model(model)
+                       for model in models]
+        prior = np.array([model.prior for model in self.models]).T
+        inherit = np.moveaxis(
+            np.array([model.inherit for model in self.models]), 0, -1
+        )
+        emit = np.moveaxis(
+            np.array([model.emit for model in self.models]), 0, -1
+        )
+        self.prior = tuple(prior)
+        self.inherit = tuple(tuple(tuple(row) for row in table)
+                             for table in inherit)
+        self.emit = tuple(tuple(row) for row in emit)
+
+    def __len__(self):
+        return len(self.models)
+
+    def emission(self, person):
+        """
+        Return the likelihood of `person`'s trait under each model for each
+        gene count, with the traits observed for that model.
+        """
+        codes = self.traits[:, person]
+        return {
+            genes: np.where(
+                codes < 0, 1.0,
+                np.where(codes == 1, self.emit[genes][1], self.emit[genes][0])
+            )
+            for genes in GENES
+        }
+
+
+def sweep_probabilities(people, configs):
+    """
+    Return a list of normalized probabilities for `people`, one for each
+    `PROBS`-shaped config (or `Model`) in `configs`.
+
+    The pedigree is peeled once with a `ModelStack`, so the elimination
+    order and cliques are shared and every table entry is computed for
+    all configs in one array operation.
+    """
+    stack = ModelStack(configs)
+    stacked = Session(people, stack).probabilities()
+    tables = [empty_probabilities(stacked) for _ in range(len(stack))]
+    for person, fields in stacked.items():
+        for field, distribution in fields.items():
+            for value, p in distribution.items():
+                p = np.broadcast_to(p, len(stack))
+                for table, p_k in zip(tables, p):
+                    table[person][field][value] = float(p_k)
+    return tables
+
+
+def locus_probabilities(people, model=None, configs=None):
+    """
+    Return a dictionary from locus name to normalized probabilities for
+    each independent gene in the "loci" of a `load_data` dictionary.
+    `configs` maps loci to `PROBS`-shaped configs (or `Model`s); loci
+    not in it use `model`, compiled from `PROBS` if omitted.
+
+    The pedigree is peeled once with a `ModelStack` holding every locus's
+    tables and traits, so the elimination order and cliques are built
+    once and all loci are computed together.
+    """
+    pedigree = Pedigree.from_people(people)
+    loci = list(people[pedigree.names[0]]["loci"]) if len(pedigree) else []
+    if model is None:
+        model = Model()
+    configs = configs or {}
+    stack = ModelStack(
+        [configs.get(locus, model) for locus in loci],
+        [[encode_trait(people[name]["loci"][locus])
+          for name in pedigree.names] for locus in loci]
+    )
+    session = Session(pedigree, stack)
+    results = {locus: empty_probabilities(pedigree.names) for locus in loci}
+
+    # Visit the root first so each message is computed only once
+    for clique in reversed(session.cliques):
+        person = clique["person"]
+        name = pedigree.names[person]
+        gene = {genes: np.broadcast_to(p, len(stack))
+                for genes, p in session.gene(person).items()}
+        for k, (locus, model) in enumerate(zip(loci, stack.models)):
+            distribution = {genes: float(gene[genes][k]) for genes in GENES}
+            results[locus][name]["gene"].update(distribution)
+            results[locus][name]["trait"].update(trait_distribution(
+                distribution, people[name]["loci"][locus], model
+            ))
+    return results
+
+
+# Inference engines selectable from the command line
+ENGINES = {
+    "batch": batch_probabilities,
+    "enumerate": enumerate_probabilities,
+    "enumerate-log": log_enumerate_probabilities,
+    "gibbs": gibbs_probabilities,
+    "parallel": parallel_probabilities,
+    "peel": peel_probabilities,
+    "search": search_probabilities
+}
+
+
+def run_engine(name, people, model=None, **options):
+    """
+    Run the engine called `name` on `people`, passing along whichever of
+    `options` it accepts. Options set to None are left at their defaults.
+    """
+    return ENGINES[name](people, model, **engine_options(name, options))
+
+
+def engine_options(name, options):
+    """
+    Return the `options` the engine called `name` accepts, without those
+    set to None.
+    """
+    accepted = inspect.signature(ENGINES[name]).parameters
+    return {
+        option: value for option, value in options.items()
+        if option in accepted and value is not None
+    }
 
 
 if __name__ == "__main__":
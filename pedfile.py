@@ -0,0 +1,171 @@
+import argparse
+import mmap
+import struct
+import sys
+from array import array
+
+import heredity
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# First bytes of every file, ending in the format version
+MAGIC = b"HEREDPF\x01"
+
+# Magic, then the number of people, families and bytes of names
+HEADER = struct.Struct("<8sQQQ")
+
+
+def main():
+
+    # Check for proper usage
+    parser = argparse.ArgumentParser(
+        description="Convert a CSV of families to the binary pedigree format."
+    )
+    parser.add_argument("data", help="CSV file with name,mother,father,trait")
+    parser.add_argument("output", help="binary file to write")
+    args = parser.parse_args()
+    people, families = convert(args.data, args.output)
+    print(f"{people} people in {families} families", file=sys.stderr)
+
+
+def convert(filename, output):
+    """
+    Write the families of the CSV `filename` to `output` in the binary
+    format read by `PedigreeFile`, and return (people, families).
+    """
+    return write(heredity.iter_families(filename), output)
+
+
+def write(pedigrees, output):
+    """
+    Write an iterable of `heredity.Pedigree`s to `output` and return
+    (people, families).
+
+    After the header come, each padded to a multiple of 8 bytes, the
+    little-endian int64 arrays of mothers, fathers, topological order,
+    family boundaries and name offsets, then the int8 trait codes and the
+    UTF-8 string table of names. Each family's people are stored
+    together, with parents and order given as indices into the whole
+    file, so family k is people boundaries[k] to boundaries[k + 1].
+    """
+    mothers = array("q")
+    fathers = array("q")
+    order = array("q")
+    traits = array("b")
+    boundaries = array("q", [0])
+    offsets = array("q", [0])
+    strings = bytearray()
+    for pedigree in pedigrees:
+        start = boundaries[-1]
+        for parents, family in ((mothers, pedigree.mothers),
+                                (fathers, pedigree.fathers)):
+            parents.extend(i + start if i >= 0 else -1 for i in family)
+        order.extend(i + start for i in pedigree.order)
+        traits.extend(pedigree.traits)
+        for name in pedigree.names:
+            strings += name.encode()
+            offsets.append(len(strings))
+        boundaries.append(start + len(pedigree))
+
+    for section in (mothers, fathers, order, boundaries, offsets):
+        if sys.byteorder != "little":
+            section.byteswap()
+    with open(output, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(traits), len(boundaries) - 1,
+                            len(strings)))
+        for section in (mothers, fathers, order, boundaries, offsets,
+                        traits, strings):
+            f.write(section)
+            f.write(bytes(-memoryview(section).nbytes % 8))
+    return len(traits), len(boundaries) - 1
+
+
+def is_pedfile(filename):
+    """
+    Return whether `filename` starts with the binary format's magic.
+    """
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class PedigreeFile:
+    """
+    Read-only view of a file written by `write`. The file is memory
+    mapped, and `mothers`, `fathers`, `order`, `boundaries`, `offsets`,
+    `traits` and `strings` are NumPy arrays over the mapping itself, so
+    opening it reads nothing but the header and worker processes opening
+    the same file share its pages. Iterating yields each family as the
+    arguments of a `heredity.Pedigree`.
+    """
+
+    def __init__(self, filename):
+        heredity.require_numpy()
+        with open(filename, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, people, families, size = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a binary pedigree file")
+
+        offset = HEADER.size
+        views = []
+        for dtype, count in (("<i8", people), ("<i8", people),
+                             ("<i8", people), ("<i8", families + 1),
+                             ("<i8", people + 1), ("i1", people),
+                             ("u1", size)):
+            views.append(np.frombuffer(self.map, dtype, count, offset))
+            offset += -(-count * views[-1].itemsize // 8) * 8
+        (self.mothers, self.fathers, self.order, self.boundaries,
+         self.offsets, self.traits, self.strings) = views
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Drop the views and unmap the file.
+        """
+        self.mothers = self.fathers = self.order = None
+        self.boundaries = self.offsets = self.traits = self.strings = None
+        self.map.close()
+
+    def __len__(self):
+        return len(self.boundaries) - 1
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self.family(k)
+
+    def names(self, start, stop):
+        """
+        Return the names of people `start` to `stop`.
+        """
+        text = self.strings[self.offsets[start]:self.offsets[stop]].tobytes()
+        ends = (self.offsets[start:stop + 1] - self.offsets[start]).tolist()
+        return [text[a:b].decode() for a, b in zip(ends, ends[1:])]
+
+    def family(self, k):
+        """
+        Return (names, mothers, fathers, traits, order) for family `k`,
+        with indices counted from its first person, as taken by
+        `heredity.Pedigree`.
+        """
+        start, stop = self.boundaries[k:k + 2].tolist()
+        mothers = self.mothers[start:stop]
+        fathers = self.fathers[start:stop]
+        return (
+            self.names(start, stop),
+            (mothers - start * (mothers >= 0)).tolist(),
+            (fathers - start * (fathers >= 0)).tolist(),
+            self.traits[start:stop].tolist(),
+            (self.order[start:stop] - start).tolist()
+        )
+
+
+if __name__ == "__main__":
+    main()
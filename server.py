@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import heredity
+
+# Compiled sessions kept by each worker process
+MODELS = 64
+
+# Latencies kept for the percentiles in the metrics
+WINDOW = 1000
+
+# Sessions compiled in this process, most recently used last
+sessions = collections.OrderedDict()
+
+
+def main():
+
+    # Check for proper usage
+    parser = argparse.ArgumentParser(
+        description="Serve gene and trait probabilities as line-delimited "
+                    "JSON over a local socket."
+    )
+    parser.add_argument(
+        "--socket", default="heredity.sock",
+        help="Unix socket to listen on"
+    )
+    parser.add_argument(
+        "--port", type=int,
+        help="listen on this localhost TCP port instead of a Unix socket"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(),
+        help="processes running inference"
+    )
+    parser.add_argument(
+        "--models", type=int, default=MODELS,
+        help="compiled families kept by each worker"
+    )
+    args = parser.parse_args()
+    server = Server(args.workers, args.models)
+    try:
+        asyncio.run(server.serve(args.socket, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+class Server:
+    """
+    Line-delimited JSON inference service. Each request is an object with
+    "people", a list of {"name", "mother", "father", "trait"} rows, and
+    optionally "evidence" (names to traits overriding the rows),
+    "targets" (the names to return, default everyone), "mutation" and an
+    "id" echoed in the response. {"op": "metrics"} returns the metrics.
+
+    Families are compiled into `heredity.Session`s by a pool of worker
+    processes. Each family always goes to the same worker, which keeps
+    its most recently used sessions, so repeated queries with new
+    evidence only update the messages that changed.
+    """
+
+    def __init__(self, workers=None, models=MODELS):
+        self.models = models
+        self.pools = [ProcessPoolExecutor(max_workers=1)
+                      for _ in range(workers or os.cpu_count())]
+        self.started = time.monotonic()
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=WINDOW)
+
+    def close(self):
+        for pool in self.pools:
+            pool.shutdown(cancel_futures=True)
+
+    async def serve(self, path, port=None):
+        """
+        Accept connections on the Unix socket at `path`, or on localhost
+        `port` if given, until cancelled.
+        """
+        if port is None:
+            if os.path.exists(path):
+                os.remove(path)
+            server = await asyncio.start_unix_server(self.connection, path)
+            where = path
+        else:
+            server = await asyncio.start_server(
+                self.connection, "127.0.0.1", port
+            )
+            where = f"127.0.0.1:{port}"
+        print(f"listening on {where}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+    async def connection(self, reader, writer):
+        """
+        Answer each request line on a connection. Requests are handled
+        concurrently and answered as they finish, so clients may send
+        several at once and match responses by "id".
+        """
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def answer(line):
+            response = await self.handle(line)
+            async with lock:
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    task = asyncio.create_task(answer(line))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def handle(self, line):
+        """
+        Return the response to one request line.
+        """
+        start = time.perf_counter()
+        request = {}
+        try:
+            request = json.loads(line)
+            if request.get("op") == "metrics":
+                return dict(self.metrics(), id=request.get("id"))
+            rows = [request_row(row) for row in request["people"]]
+            mutation = request.get("mutation", heredity.PROBS["mutation"])
+            key = family_key(rows, mutation)
+            pool = self.pools[int(key[:8], 16) % len(self.pools)]
+            probabilities, hit = await asyncio.get_running_loop(
+            ).run_in_executor(
+                pool, infer, key, rows, request.get("evidence") or {},
+                request.get("targets"), mutation, self.models
+            )
+            self.counts["hits" if hit else "misses"] += 1
+            response = {"probabilities": probabilities}
+        except Exception as e:
+            self.counts["errors"] += 1
+            response = {"error": f"{e!r}"}
+        self.counts["requests"] += 1
+        self.latencies.append(time.perf_counter() - start)
+        if isinstance(request, dict) and "id" in request:
+            response["id"] = request["id"]
+        return response
+
+    def metrics(self):
+        """
+        Return request counts, compiled-family cache hits and misses,
+        throughput since start and latency percentiles of recent requests.
+        """
+        uptime = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+        return {
+            "uptime": uptime,
+            "throughput": self.counts["requests"] / uptime,
+            "latency": {
+                f"p{q}": percentile(latencies, q) for q in (50, 95, 99)
+            },
+            **{name: self.counts[name]
+               for name in ("requests", "errors", "hits", "misses")}
+        }
+
+
+def request_row(row):
+    """
+    Return the (name, mother, father, trait) row of `heredity.Pedigree`
+    codes for a request row, whose trait is true, false or null.
+    """
+    return (
+        row["name"],
+        row.get("mother") or None,
+        row.get("father") or None,
+        heredity.encode_trait(row.get("trait"))
+    )
+
+
+def family_key(rows, mutation):
+    """
+    Return a hash of a family's names, parents and mutation rate, which
+    identify its compiled session regardless of the traits.
+    """
+    return hashlib.sha256(repr((
+        [row[:3] for row in rows], mutation
+    )).encode()).hexdigest()
+
+
+def infer(key, rows, evidence, targets, mutation, models=MODELS):
+    """
+    Return (probabilities, hit) for a family in a worker process. The
+    compiled session stored under `key` is reused if there is one (`hit`),
+    with its traits updated to those of `rows` and `evidence`; otherwise
+    it is compiled and stored, evicting the least recently used beyond
+    `models`. Each person's probabilities are a gene list ordered as
+    `heredity.GENES` and the probability of the trait.
+    """
+    session = sessions.get(key)
+    hit = session is not None
+    if hit:
+        sessions.move_to_end(key)
+    else:
+        model = heredity.Model(dict(heredity.PROBS, mutation=mutation))
+        session = heredity.Session(heredity.pedigree_from_rows(rows), model)
+        sessions[key] = session
+        while len(sessions) > models:
+            sessions.popitem(last=False)
+
+    # Only people whose traits changed update the session's messages
+    pedigree = session.pedigree
+    traits = [row[3] for row in rows]
+    for name, trait in evidence.items():
+        traits[pedigree.index[name]] = heredity.encode_trait(trait)
+    for i, trait in enumerate(traits):
+        if pedigree.traits[i] != trait:
+            session.set_trait(pedigree.names[i],
+                              heredity.decode_trait(trait))
+
+    probabilities = {}
+    for name in targets or pedigree.names:
+        marginal = session.marginal(name)
+        probabilities[name] = {
+            "gene": [marginal["gene"][g] for g in heredity.GENES],
+            "trait": marginal["trait"][True]
+        }
+    return probabilities, hit
+
+
+def percentile(values, q):
+    """
+    Return the `q`th percentile of sorted `values`, or None if empty.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, len(values) * q // 100)]
+
+
+if __name__ == "__main__":
+    main()
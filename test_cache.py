@@ -0,0 +1,134 @@
+import os
+import tempfile
+import unittest
+
+import cache
+import heredity
+
+
+def family(names=("Harry", "James", "Lily"), order=(0, 1, 2),
+           swapped=False):
+    """
+    Return the family0 pedigree under `names`, with its rows in `order`,
+    and with the roles of Harry's parents swapped if `swapped` is set.
+    """
+    harry, james, lily = names
+    rows = {
+        harry: (james, lily) if swapped else (lily, james),
+        james: (None, None),
+        lily: (None, None)
+    }
+    traits = {harry: -1, james: 1, lily: 0}
+    names = [names[k] for k in order]
+    index = {name: i for i, name in enumerate(names)}
+    return heredity.Pedigree(
+        names,
+        [-1 if rows[name][0] is None else index[rows[name][0]]
+         for name in names],
+        [-1 if rows[name][1] is None else index[rows[name][1]]
+         for name in names],
+        [traits[name] for name in names]
+    )
+
+
+def sibling_mating():
+    """
+    Return a pedigree in which siblings have two children with the same
+    trait, so its loop leaves two people indistinguishable by shape.
+    """
+    return heredity.Pedigree(
+        ["A", "B", "C", "D", "E", "F"],
+        [-1, -1, 0, 0, 2, 2],
+        [-1, -1, 1, 1, 3, 3],
+        [-1, -1, -1, -1, 1, 1]
+    )
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model = heredity.Model()
+
+    def key(self, pedigree):
+        return cache.fingerprint(pedigree, self.model)[0]
+
+    def test_names_and_order_do_not_matter(self):
+        self.assertEqual(
+            self.key(family()),
+            self.key(family(("Ron", "Arthur", "Molly"), (2, 0, 1)))
+        )
+
+    def test_parent_roles_matter(self):
+        self.assertNotEqual(self.key(family()),
+                            self.key(family(swapped=True)))
+
+    def test_engine_matters(self):
+        pedigree = family()
+        self.assertNotEqual(
+            cache.fingerprint(pedigree, self.model, ("peel", []))[0],
+            cache.fingerprint(pedigree, self.model, ("gibbs", []))[0]
+        )
+
+    def test_loops_fall_back_to_names(self):
+        pedigree = sibling_mating()
+        key, labels = cache.fingerprint(pedigree, self.model)
+        self.assertEqual(labels, pedigree.names)
+        renamed = heredity.Pedigree(
+            [name.lower() for name in pedigree.names], pedigree.mothers,
+            pedigree.fathers, pedigree.traits
+        )
+        self.assertNotEqual(key, self.key(renamed))
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "cache.db")
+        self.model = heredity.Model()
+
+    def test_results_map_back_onto_renamed_people(self):
+        pedigree = family()
+        renamed = family(("Ron", "Arthur", "Molly"), (2, 0, 1))
+        with cache.ResultCache(self.path) as results:
+            probabilities = cache.cached_run_engine(
+                results, "peel", pedigree, self.model
+            )
+            cache.cached_run_engine(results, "enumerate", renamed, self.model)
+            self.assertEqual(results.stats()["hits"], 0)
+            stored = cache.cached_run_engine(
+                results, "peel", renamed, self.model
+            )
+            self.assertEqual(results.stats()["hits"], 1)
+        for old, new in (("Harry", "Ron"), ("James", "Arthur"),
+                         ("Lily", "Molly")):
+            for genes in heredity.GENES:
+                self.assertAlmostEqual(probabilities[old]["gene"][genes],
+                                       stored[new]["gene"][genes])
+
+    def test_least_recently_used_is_evicted(self):
+        pedigrees = [family(), family(swapped=True), sibling_mating()]
+        probabilities = [heredity.peel_probabilities(pedigree, self.model)
+                         for pedigree in pedigrees]
+        sizes = []
+        with cache.ResultCache(self.path) as results:
+            for pedigree, result in zip(pedigrees, probabilities):
+                results.put(pedigree, self.model, result)
+                sizes.append(results.stats()["bytes"] - sum(sizes))
+        os.remove(self.path)
+
+        # Room for the first result with either of the others
+        limit = sizes[0] + max(sizes[1:])
+        with cache.ResultCache(self.path, limit) as results:
+            results.put(pedigrees[0], self.model, probabilities[0])
+            results.put(pedigrees[1], self.model, probabilities[1])
+            self.assertIsNotNone(results.get(pedigrees[0], self.model))
+            results.put(pedigrees[2], self.model, probabilities[2])
+            self.assertIsNone(results.get(pedigrees[1], self.model))
+            self.assertIsNotNone(results.get(pedigrees[0], self.model))
+            self.assertIsNotNone(results.get(pedigrees[2], self.model))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+import glob
+import os
+import random
+import tempfile
+import unittest
+
+import benchmark
+import heredity
+
+# Directory of the example families
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# Largest difference allowed between exact engines
+EXACT = 1e-9
+
+# Largest difference allowed for the sampling engine
+SAMPLED = 0.05
+
+# Largest difference allowed when search prunes unlikely branches
+PRUNED = 0.01
+
+# Options keeping every engine's run short and repeatable
+OPTIONS = {"workers": 2, "chunk_size": 27, "sweeps": 4000, "seed": 0}
+
+
+def example_families():
+    """
+    Return (description, pedigree) for each family in the example files.
+    """
+    families = []
+    for filename in sorted(glob.glob(os.path.join(DATA, "family*.csv"))):
+        for k, pedigree in enumerate(heredity.iter_families(filename)):
+            families.append((f"{os.path.basename(filename)}#{k}", pedigree))
+    return families
+
+
+def looped_family():
+    """
+    Return a seeded random pedigree in which cousins have children.
+    """
+    return benchmark.generate(seed=0, **benchmark.SCENARIOS["inbred"])
+
+
+class EngineTest(unittest.TestCase):
+
+    def assertClose(self, expected, actual, tolerance):
+        for person in expected:
+            for field in expected[person]:
+                for value, p in expected[person][field].items():
+                    self.assertAlmostEqual(
+                        p, actual[person][field][value], delta=tolerance,
+                        msg=f"{person} {field} {value}"
+                    )
+
+    def check_engines(self, pedigree):
+        model = heredity.Model()
+        expected = heredity.enumerate_probabilities(
+            pedigree, model, compress=False
+        )
+        for engine in sorted(heredity.ENGINES):
+            with self.subTest(engine=engine):
+                actual = heredity.run_engine(engine, pedigree, model,
+                                             **OPTIONS)
+                tolerance = SAMPLED if engine == "gibbs" else EXACT
+                self.assertClose(expected, actual, tolerance)
+
+    def test_example_families(self):
+        for description, pedigree in example_families():
+            with self.subTest(family=description):
+                self.check_engines(pedigree)
+
+    def test_looped_family(self):
+        pedigree = looped_family()
+        self.assertTrue(heredity.has_loops(pedigree))
+        self.check_engines(pedigree)
+
+    def test_search_epsilon(self):
+        model = heredity.Model()
+        for description, pedigree in example_families():
+            with self.subTest(family=description):
+                stats = heredity.Stats()
+                expected = heredity.enumerate_probabilities(pedigree, model)
+                actual = heredity.search_probabilities(
+                    pedigree, model, epsilon=1e-4, stats=stats
+                )
+                self.assertGreater(stats.counters["pruned"], 0)
+                self.assertClose(expected, actual, PRUNED)
+
+    def test_gibbs_single_chain(self):
+        pedigree = example_families()[1][1]
+        result = heredity.gibbs_sample(pedigree, chains=1, sweeps=200,
+                                       seed=0)
+        for key in ("errors", "rhat"):
+            for person in result[key].values():
+                for p in person["gene"].values():
+                    self.assertNotEqual(p, p)
+
+    def test_family0(self):
+        pedigree = next(heredity.iter_families(
+            os.path.join(DATA, "family0.csv")
+        ))
+        gene = heredity.peel_probabilities(pedigree)["Harry"]["gene"]
+        for genes, p in ((2, 0.0092), (1, 0.4557), (0, 0.5351)):
+            self.assertAlmostEqual(gene[genes], p, places=4)
+
+    def test_wide_sibship(self):
+        children = 400
+        pedigree = heredity.Pedigree(
+            ["mother", "father"] + [f"child{i}" for i in range(children)],
+            [-1, -1] + [0] * children,
+            [-1, -1] + [1] * children,
+            [-1, 1] + [i % 3 - 1 for i in range(children)]
+        )
+        model = heredity.Model()
+        expected = heredity.log_enumerate_probabilities(pedigree, model)
+        actual = heredity.peel_probabilities(pedigree, model)
+        self.assertClose(expected, actual, EXACT)
+
+
+class SessionTest(unittest.TestCase):
+
+    def test_trait_updates(self):
+        rng = random.Random(0)
+        for pedigree in (example_families()[-1][1], looped_family()):
+            session = heredity.Session(pedigree)
+            traits = list(pedigree.traits)
+            for _ in range(30):
+                name = rng.choice(pedigree.names)
+                trait = rng.choice([True, False, None])
+                if trait is None:
+                    session.clear_trait(name)
+                else:
+                    session.set_trait(name, trait)
+                traits[pedigree.index[name]] = heredity.encode_trait(trait)
+
+                # Only some marginals are asked for between updates, so
+                # down messages are left stale in between
+                fresh = heredity.Session(heredity.Pedigree(
+                    pedigree.names, pedigree.mothers, pedigree.fathers,
+                    traits
+                ))
+                for other in rng.sample(pedigree.names, 3):
+                    expected = fresh.marginal(other)
+                    actual = session.marginal(other)
+                    for field in expected:
+                        for value, p in expected[field].items():
+                            self.assertAlmostEqual(
+                                p, actual[field][value], delta=EXACT
+                            )
+
+
+class PedigreeTest(unittest.TestCase):
+
+    def test_problems_are_reported_together(self):
+        rows = [
+            ("A", None, None, 1),
+            ("B", "A", None, -1),
+            ("C", "A", "Z", -1),
+            ("A", None, None, 0)
+        ]
+        with self.assertRaises(heredity.PedigreeError) as caught:
+            heredity.pedigree_from_rows(rows)
+        self.assertEqual(len(caught.exception.problems), 3)
+
+    def test_empty_file(self):
+        with tempfile.NamedTemporaryFile(suffix=".csv") as f:
+            self.assertEqual(list(heredity.iter_families(f.name)), [])
+
+    def test_cycles(self):
+
+        # C and D are each other's child; E descends from the cycle
+        # without being on it
+        rows = [
+            ("A", None, None, -1),
+            ("B", None, None, -1),
+            ("C", "D", "A", -1),
+            ("D", "B", "C", -1),
+            ("E", "C", "B", -1),
+            ("F", "A", "B", -1)
+        ]
+        with self.assertRaises(heredity.PedigreeError) as caught:
+            heredity.pedigree_from_rows(rows)
+        self.assertEqual(caught.exception.problems, [
+            "line 4: C is their own ancestor",
+            "line 5: D is their own ancestor"
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
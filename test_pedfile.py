@@ -0,0 +1,73 @@
+import glob
+import os
+import tempfile
+import unittest
+
+import benchmark
+import heredity
+import pedfile
+
+# Directory of the example families
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def fields(pedigree):
+    """
+    Return the stored fields of `pedigree` as plain lists.
+    """
+    return (list(pedigree.names), list(pedigree.mothers),
+            list(pedigree.fathers), list(pedigree.traits),
+            list(pedigree.order))
+
+
+class RoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def round_trip(self, filename):
+        output = os.path.join(self.directory, "families.ped")
+        pedfile.convert(filename, output)
+        self.assertTrue(pedfile.is_pedfile(output))
+        self.assertFalse(pedfile.is_pedfile(filename))
+        expected = [fields(p) for p in heredity.iter_families(filename)]
+        actual = [fields(p) for p in heredity.iter_families(output)]
+        self.assertEqual(expected, actual)
+
+    def test_example_families(self):
+        for filename in sorted(glob.glob(os.path.join(DATA, "family*.csv"))):
+            with self.subTest(filename=os.path.basename(filename)):
+                self.round_trip(filename)
+
+    def test_many_families(self):
+
+        # Families of odd sizes with names of odd lengths, some not ASCII,
+        # so no section ends on an 8-byte boundary
+        filename = os.path.join(self.directory, "families.csv")
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write("name,mother,father,trait\n")
+            for k, size in enumerate((3, 7, 11, 5)):
+                pedigree = benchmark.generate(size=size, depth=3, seed=k)
+                for i, name in enumerate(pedigree.names):
+                    parents = [
+                        "" if j < 0 else f"{pedigree.names[j]}é{k}"
+                        for j in (pedigree.mothers[i], pedigree.fathers[i])
+                    ]
+                    trait = pedigree.trait(i)
+                    f.write(",".join([
+                        f"{name}é{k}", *parents,
+                        "" if trait is None else str(int(trait))
+                    ]) + "\n")
+        self.round_trip(filename)
+
+        output = os.path.join(self.directory, "families.ped")
+        with pedfile.PedigreeFile(output) as registry:
+            self.assertEqual(len(registry), 4)
+            self.assertEqual(registry.boundaries.tolist(), [0, 3, 10, 21, 26])
+            self.assertEqual(len(registry.traits), 26)
+
+
+if __name__ == "__main__":
+    unittest.main()